@@ -7,8 +7,10 @@ import torch
 import collections
 from typing import Mapping
 import time
+import threading
 
 from AlphaZeroNet import AlphaZeroNet
+from SearchStats import SearchStats
 from utils import *
 
     
@@ -19,21 +21,62 @@ class DummyNode:
         self.parent = None
         self.child_W = collections.defaultdict(float)
         self.child_N = collections.defaultdict(float)
+        self.lock = threading.Lock()
 
 class Node:
-    def __init__(self, board, pi=None, parent=None, action=None):
+    """Node of the search tree.
+
+    The statistics of the children are only kept for the legal actions, in small arrays indexed by legal-move slot:
+    actions maps every slot back to its index in the NUM_ACTIONS action space. It is set when the node is created,
+    the statistics are allocated on expansion, so the leaves of the tree only hold the indices of their legal actions.
+    """
+
+    __slots__ = ('turn', 'hash', 'is_terminal', 'winner', 'is_expanded', 'parent', 'action',
+                 'actions', 'child_W', 'child_N', 'pi', 'children', 'lock')
+
+    def __init__(self, board, parent=None, action=None):
         self.turn = board.turn
-        self.is_terminal, self.winner = board.check_end_game()
+        self.hash = board.hash
+
+        # same outcome as board.check_end_game(), but the legal moves are generated only once: they tell whether the
+        # player to move is stuck and they are kept for the expansion
+        self.actions = None     # action indices of the legal moves, one per slot
+        if board.king_captured():
+            self.is_terminal, self.winner = True, BLACK_PLAYER
+        elif board.king_escaped():
+            self.is_terminal, self.winner = True, WHITE_PLAYER
+        else:
+            self.actions = np.array(board.legal_action_indices(), dtype=np.int16)
+            self.is_terminal = len(self.actions) == 0
+            self.winner = 1 - self.turn if self.is_terminal else None
 
         self.is_expanded = False
         self.parent = parent
-        self.action = action    # the action that from the parent's board lead to this Node's board
+        self.action = action    # the slot, in the parent, of the action that lead to this Node's board
+
+        self.child_W = None
+        self.child_N = None
+        self.pi = None
 
-        self.child_W = np.zeros(NUM_ACTIONS, dtype=np.float32)
-        self.child_N = np.zeros(NUM_ACTIONS, dtype=np.float32)
-        self.pi = np.zeros(NUM_ACTIONS, dtype=np.float32) if pi is None else pi
+        self.children: Mapping[int, Node] = {}     # by slot
+        self.lock = threading.Lock()    # guards the child statistics and the expansion when searching with threads
+
+    def expand(self, pi):
+        """Allocate the statistics of the legal actions
+
+        Args:
+            pi (np.ndarray): the NUM_ACTIONS priors given by the network
+        """
+        self.child_W = np.zeros(len(self.actions), dtype=np.float32)
+        self.child_N = np.zeros(len(self.actions), dtype=np.float32)
+        self.set_pi(pi)
+        self.is_expanded = True
 
-        self.children: Mapping[int, Node] = {}
+    def to_dense(self, values):
+        """Scatter values stored by slot, e.g. child_N, back to the NUM_ACTIONS action space"""
+        dense = np.zeros(NUM_ACTIONS, dtype=np.float32)
+        dense[self.actions] = values
+        return dense
 
     @property
     def N(self):
@@ -56,84 +99,580 @@ class Node:
 
         
     def set_pi(self, pi):
-        self.pi = pi
+        self.pi = pi[self.actions]
 
 
     
 
+def run_network_requests(steps):
+    """Run a generator of network requests, such as AI._evaluation_steps, calling the networks one request at a time
+
+    Returns:
+        The value returned by the generator
+    """
+    try:
+        request = next(steps)
+        while True:
+            network, planes = request
+            with torch.inference_mode():
+                pi, v = network(torch.from_numpy(planes))
+            request = steps.send((pi.numpy(), v.numpy().ravel()))
+    except StopIteration as stop:
+        return stop.value
+
+
+def lockstep_MCTS(searches, num_simulations=None, root_noise=True):
+    """Search the positions of many games at once in one process, evaluating their leaves together
+
+    Every search advances until it needs a network evaluation, then the pending leaves of all the searches go through
+    their network in one forward pass, one per distinct network. The only concurrency is the batching of leaves of
+    separate games, so no virtual loss is needed and the batch size is the number of games.
+
+    Args:
+        searches (list): the (ai, board) pairs to search, an AI can appear only once as it holds the tree of its search
+        num_simulations (int): simulations of every search, the budget of each AI if not given
+
+    Returns:
+        The MCTS result (action, win rate, search policy) of every search
+    """
+    steps = [ai.search_steps(board, num_simulations, root_noise) for ai, board in searches]
+    results = [None] * len(steps)
+    requests = {}
+
+    def advance(i, response):
+        try:
+            requests[i] = steps[i].send(response)
+        except StopIteration as stop:
+            results[i] = stop.value
+
+    for i in range(len(steps)):
+        advance(i, None)
+
+    while requests:
+        pending = requests
+        requests = {}
+        by_network = {}     # networks are not hashable in general, group them by identity
+        for i, (network, planes) in pending.items():
+            by_network.setdefault(id(network), (network, []))[1].append(i)
+
+        for network, indices in by_network.values():
+            with torch.inference_mode():
+                pi, v = network(torch.from_numpy(np.concatenate([pending[i][1] for i in indices])))
+            pi, v = pi.numpy(), v.numpy().ravel()
+            start = 0
+            for i in indices:
+                end = start + len(pending[i][1])
+                advance(i, (pi[start:end], v[start:end]))
+                start = end
+    return results
+
+
 class AI:
-    def __init__(self, budget, player_color):
+    def __init__(self, budget, player_color, transpositions=False, batch_size=1, virtual_loss=1, num_threads=1,
+                 reuse_tree=False, eval_cache=None, instrument=False, stats_log=None):
         self.budget = budget
         self.player_color = player_color
         self.root_board = None
-        self.search_board = None
+        self.root = None    # root of the last search, for callers that need its visit counts
+        self._thread_data = threading.local()    # every search thread walks its own copy of the board
 
         self.alphazero = None
         self.opponent = None
 
-    def MCTS(self, board, timeout=60, root_noise = True):
+        # with transpositions the search is a graph: positions reached through different move orders share one Node,
+        # found through the Zobrist hash of the board, so they are evaluated by the network only once
+        self.transpositions = transpositions
+        self.transposition_table = {}
+        self.transposition_lock = threading.Lock()
+        self.tt_lookups = 0     # cumulative over all the searches of this AI
+        self.tt_hits = 0
+
+        # with batch_size > 1 every round selects batch_size leaves and evaluates them with one forward pass,
+        # the virtual loss added along the pending paths pushes the selections of the same round apart
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.simulations = 0    # simulations run by the last search
+
+        # with num_threads > 1 the threads descend the same tree, the virtual loss keeps them on different paths
+        self.num_threads = num_threads
+        self.simulations_lock = threading.Lock()
+
+        # with reuse_tree the search starts from the node of the last tree reached by our move and the opponent's reply
+        self.reuse_tree = reuse_tree
+        self.reused_visits = 0  # visits of the root inherited from the last search
+
+        # pondering searches the position after our move in the background, while the opponent thinks
+        self._stop_search = threading.Event()
+        self._ponder_thread = None
+
+        # optional EvaluationCache, it outlives the searches and can be shared by several AIs
+        self.eval_cache = eval_cache
+
+        # with instrument every MCTS call fills a SearchStats, appended as a JSON line to stats_log when given.
+        # Disabled, the only cost is a check of search_stats around the phases
+        self.instrument = instrument or stats_log is not None
+        self.stats_log = stats_log
+        self.search_stats = None    # SearchStats of the running (or last) instrumented search
+
+    @property
+    def search_board(self):
+        return self._thread_data.board
+
+    @search_board.setter
+    def search_board(self, board):
+        self._thread_data.board = board
+
+    def MCTS(self, board, timeout=60, root_noise = True, return_stats=False):
         """Perform Monte Carlo Tree Search starting from a board configuration
 
         Args:
             board (Board): the board configuration from which to start the search
+            return_stats (bool): also return the SearchStats of the search, None unless the AI is instrumented
         Returns:
-            The action to take and its predicted win rate
+            The action to take, its predicted win rate and the search policy (and the SearchStats)
         """
         assert timeout > 0
         timeout -= 5   # keep 5 seconds to be safe
 
-        start_time = time.process_time()
+        # wall clock time: the server limit is on it, and the CPU time of many threads runs faster
+        start_time = time.perf_counter()
+        stats = self.search_stats = SearchStats() if self.instrument else None
 
         self.root_board = board
-        pi, _ = self.alphazero(self.root_board.to_onehot_tensor())
-        pi = pi.detach().numpy().ravel()
-        
-        if root_noise:
-            pi = self._add_dirichlet_noise(pi, self.root_board.legal_actions_array())
+        root = self._prepare_root(board, root_noise)
+
+        self.simulations = 0
+        self._run_search(root, board, start_time, timeout)
+        result = self._search_result(root)
+
+        if stats is not None:
+            stats.finish(self.simulations, self._tree_size(root))
+            if self.stats_log is not None:
+                stats.write(self.stats_log)
+        return (*result, stats) if return_stats else result
+
+    def search_steps(self, board, num_simulations=None, root_noise=True):
+        """Generator version of MCTS, running a fixed number of simulations, for lockstep_MCTS
+
+        Every time a network evaluation is needed the generator yields a (network, planes) request and expects the
+        (pis, vs) of the network to be sent back, so that the caller can batch the requests of many searches.
+        Simulations run one at a time, without virtual loss.
+
+        Args:
+            board (Board): the board configuration from which to start the search
+            num_simulations (int): simulations to run, the budget of the AI if not given
+
+        Returns:
+            The same as MCTS, as the value of the StopIteration
+        """
+        self.root_board = board
+        self.search_stats = None    # the network time of lockstep searches is shared, they are not instrumented
+        pis, _ = yield from self._evaluation_steps([board.to_planes()], [board.turn])
+        root = self._prepare_root(board, root_noise, pis[0])
+
+        self.search_board = copy.deepcopy(board)
+        self.simulations = 0
+        for _ in range(self.budget if num_simulations is None else num_simulations):
+            node, path, undo_records = self._select(root)
+            v = self._leaf_value(node)
+            if v is None:
+                pis, vs = yield from self._evaluation_steps([self.search_board.to_planes()], [node.turn])
+                self._set_expanded(node, pis[0])
+                v = float(vs[0])
+            self._backpropagate(path, v)
+            self._undo(undo_records)
+            self.simulations += 1
+        return self._search_result(root)
+
+    def _search_result(self, root):
+        """The move chosen after searching root, its predicted win rate and the search policy"""
+        slot, action_win_rate = self._best_action(root, c=0)   # Note: action_win_rate is in range [-1, 1]
+
+        return self.root_board.index_to_action(int(root.actions[slot])), action_win_rate, self._generate_search_policy(root)
+
+
+    def start_pondering(self, board):
+        """Keep searching board, the position after our move, in a background thread until stop_pondering is called
+
+        The tree grown meanwhile is kept: with reuse_tree the next search starts from the node of the opponent's reply.
+        """
+        assert self._ponder_thread is None, "Already pondering"
+        if board.check_end_game()[0]:
+            return
+
+        self.search_stats = None
+        root = self._prepare_root(board, root_noise=False)
+        self.simulations = 0
+        self._stop_search.clear()
+        # the board is copied right away, the caller is free to change it while the thread starts
+        self._ponder_thread = threading.Thread(target=self._run_search, daemon=True,
+                                               args=(root, copy.deepcopy(board), time.perf_counter(), float('inf')))
+        self._ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the background search started by start_pondering
+
+        Returns:
+            The number of simulations run while pondering
+        """
+        if self._ponder_thread is None:
+            return 0
+        self._stop_search.set()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+        self._stop_search.clear()
+        return self.simulations
+
+    def _prepare_root(self, board, root_noise, pi=None):
+        """Create the root node of a search on board, or take it from the last tree when reuse_tree is set
+
+        Args:
+            pi (np.ndarray): the policy of the network for board, evaluated here if not given
+        """
+        if pi is None:
+            pis, _ = self._evaluate_batch([board.to_planes()], [board.turn])
+            pi = pis[0]
+
+        root = self._find_reusable_root(board) if self.reuse_tree else None
+        if root is None:
+            stats = self.search_stats
+            if stats is not None:
+                since = stats.clock()
+            root = Node(board, parent=DummyNode())
+            if stats is not None:
+                stats.add('legal_mask', since)
+            self.reused_visits = 0
+        else:
+            dummy = DummyNode()
+            dummy.child_N[None] = root.N
+            dummy.child_W[None] = root.W
+            root.parent, root.action = dummy, None    # detach it from the old tree
+            self.reused_visits = root.N
+
+        if root_noise and not root.is_terminal:
+            pi = self._add_dirichlet_noise(pi, root.to_dense(1))
+
+        if root.is_expanded:
+            root.set_pi(pi)
+        elif not root.is_terminal:
+            root.expand(pi)
+        self.root = root
+        self.transposition_table = self._subtree_table(root) if self.transpositions else {}
+        return root
+
+    def _find_reusable_root(self, board, max_depth=2):
+        """Look for the node of board among the descendants of the last root, down to max_depth moves
 
-        root = Node(board, pi=pi, parent=DummyNode())
+        Returns:
+            The expanded node with the same Zobrist hash as board, None if the last search did not reach board
+        """
+        if self.root is None:
+            return None
+        frontier = [self.root]
+        for _ in range(max_depth):
+            frontier = [child for node in frontier for child in node.children.values()]
+            for node in frontier:
+                if node.hash == board.hash and node.is_expanded:
+                    return node
+        return None
+
+    def _subtree_table(self, root):
+        """Transposition table of the nodes reachable from root, the rest of the last tree is dropped"""
+        table = {root.hash: root}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in node.children.values():
+                if child.hash not in table:
+                    table[child.hash] = child
+                    stack.append(child)
+        return table
+
+    def _run_search(self, root, board, start_time, timeout):
+        """Search from root until the timeout or until the search is stopped, with num_threads threads"""
+        if self.num_threads > 1:
+            threads = [threading.Thread(target=self._search, args=(root, board, start_time, timeout))
+                       for _ in range(self.num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            self._search(root, board, start_time, timeout)
+
+    def _search(self, root, board, start_time, timeout):
+        """Search loop run by every thread until the timeout or until the search is stopped"""
+        # a private copy of the board is walked down and back up in every simulation
+        stats = self.search_stats
+        if stats is not None:
+            since = stats.clock()
+        self.search_board = copy.deepcopy(board)
+        if stats is not None:
+            stats.add('copy', since)
+
+        simulations = 0
+        # while simulations < self.budget:    # to work with iterations instead of time
+        while time.perf_counter() - start_time < timeout and not self._stop_search.is_set():
+            if self.batch_size > 1:
+                simulations += self._batched_simulations(root)
+            else:
+                simulations += self._simulation(root)
+            # if ((simulations + 1) % 100 == 0):
+            #     print(f"Iterations/budget: {simulations + 1}/{self.budget}")
 
+        with self.simulations_lock:
+            self.simulations += simulations
 
-        # iters = 0
-        # while iters < self.budget:    # to work with iterations instead of time
+    def _simulation(self, root):
+        """Run a single simulation: select a leaf, evaluate it and backpropagate its value
 
-        while  time.process_time() - start_time < timeout:
-            self.search_board = copy.deepcopy(board)
+        Returns:
+            The number of simulations run, i.e. 1
+        """
+        virtual_loss = self.virtual_loss if self.num_threads > 1 else 0
+        stats = self.search_stats
+        if stats is not None:
+            since = stats.clock()
+        node_to_expand, path, undo_records = self._select(root, virtual_loss)
+        if stats is not None:
+            stats.add('select', since)
+            stats.add_depth(len(path) - 1)
+
+        v = self._leaf_value(node_to_expand)
+        if v is None:
+            v = self._expand(node_to_expand)
+
+        if stats is not None:
+            since = stats.clock()
+        self._backpropagate(path, v, virtual_loss)
+        self._undo(undo_records)
+        if stats is not None:
+            stats.add('backprop', since)
+        return 1
+
+    def _batched_simulations(self, root):
+        """Run up to batch_size simulations whose leaves are evaluated together, with one forward pass per network
+
+        Every pending path gets a virtual loss, so that the next selections of the round are steered towards other
+        leaves. It is removed again when the values of the network are backpropagated.
 
-            node_to_expand = self._select(root)
-            if node_to_expand.is_terminal:
-                v = 1 if node_to_expand.winner == node_to_expand.turn else -1
+        Returns:
+            The number of simulations run
+        """
+        leaves = []     # (node, path) of the leaves waiting for the network
+        planes = np.empty((self.batch_size, 3, GRID_COUNT, GRID_COUNT), dtype=np.float32)    # filled in place
+        pending = set()
+        simulations = 0
+        stats = self.search_stats
+        for _ in range(self.batch_size):
+            if stats is not None:
+                since = stats.clock()
+            node, path, undo_records = self._select(root, self.virtual_loss)
+            if stats is not None:
+                stats.add('select', since)
+                stats.add_depth(len(path) - 1)
+                since = stats.clock()
+
+            v = self._leaf_value(node)
+            if v is not None:
+                self._backpropagate(path, v, self.virtual_loss)
+                simulations += 1
+            elif id(node) in pending:
+                # the virtual loss could not steer the search away from a pending leaf, evaluate what we have
+                self._add_virtual_loss(path, -self.virtual_loss)
+                self._undo(undo_records)
+                if stats is not None:
+                    stats.add('backprop', since)
+                break
             else:
-                v = self._expand(node_to_expand)
-            self._backpropagate(node_to_expand, v)
-    
-            # iters += 1
-            # if ((iters + 1) % 100 == 0):
-            #     print(f"Iterations/budget: {iters + 1}/{self.budget}")
-    
-        root_legal_actions = self.root_board.legal_actions_array()
-        best_child, action, action_win_rate = self._best_child(root, root_legal_actions, c=0)   # Note: action_win_rate is in range [-1, 1]
-        
-        return self.root_board.index_to_action(action), action_win_rate, self._generate_search_policy(root, root_legal_actions)
+                pending.add(id(node))
+                self.search_board.write_planes(planes, len(leaves))
+                leaves.append((node, path))
+                if stats is not None:
+                    stats.add('encode', since)
+                    since = stats.clock()
+            self._undo(undo_records)
+            if stats is not None:
+                stats.add('backprop', since)
+
+        if len(leaves) == 0:
+            return simulations
+
+        pis, vs = self._evaluate_batch(planes[:len(leaves)], [node.turn for node, _ in leaves])
+        if stats is not None:
+            since = stats.clock()
+        for node, pi in zip((node for node, _ in leaves), pis):
+            self._set_expanded(node, pi)
+        if stats is not None:
+            stats.add('expand', since)
+            since = stats.clock()
+        for (node, path), v in zip(leaves, vs):
+            self._backpropagate(path, float(v), self.virtual_loss)
+        if stats is not None:
+            stats.add('backprop', since)
+        return simulations + len(leaves)
+
+    def _leaf_value(self, node):
+        """Value of a leaf that needs no network evaluation, None if the leaf has to be expanded"""
+        if node is None:
+            return 0    # the path went back to a position already on it: the server calls a repeated state a draw
+        if node.is_terminal:
+            return 1 if node.winner == node.turn else -1
+        return None
+
+    def _undo(self, undo_records):
+        for record in reversed(undo_records):
+            self.search_board.undo_action(record)
+
+    def _add_virtual_loss(self, path, loss):
+        """Count loss more visits on every edge of path, all of them lost by the player who chose the edge"""
+        for parent, slot in path:
+            with parent.lock:
+                parent.child_N[slot] += loss
+                parent.child_W[slot] += loss
+
+    def _evaluate_batch(self, planes, turns):
+        """Evaluate a batch of positions, each one with the network of the player to move
+
+        Args:
+            planes (list): the (3, 9, 9) one-hot planes of the positions, or a (N, 3, 9, 9) array
+            turns (list): the player to move in each position
+
+        Returns:
+            The policies as a (N, NUM_ACTIONS) array and the values as a (N,) array
+        """
+        return run_network_requests(self._evaluation_steps(planes, turns))
+
+    def _evaluation_steps(self, planes, turns):
+        """Generator evaluating a batch of positions: it yields a (network, planes) request for each network needed
+        and expects its (pis, vs) back
 
+        Every network call of the search goes through here, so that the evaluation cache, when there is one, answers
+        for the positions it already knows (or a symmetric version of them)
 
-    def _select(self, root):
+        Args:
+            planes (list): the (3, 9, 9) one-hot planes of the positions, or a (N, 3, 9, 9) array
+            turns (list): the player to move in each position
+
+        Returns:
+            The policies as a (N, NUM_ACTIONS) array and the values as a (N,) array
+        """
+        pis = np.empty((len(planes), NUM_ACTIONS), dtype=np.float32)
+        vs = np.empty(len(planes), dtype=np.float32)
+        for network, own_turn in ((self.alphazero, True), (self.opponent, False)):
+            indices = [i for i, turn in enumerate(turns) if (turn == self.player_color) == own_turn]
+
+            cache_keys = {}     # cache key and symmetry of the positions missing from the cache
+            if self.eval_cache is not None:
+                for i in indices:
+                    key, symmetry = self.eval_cache.key(network, planes[i])
+                    cached = self.eval_cache.get(key, symmetry)
+                    if cached is None:
+                        cache_keys[i] = (key, symmetry)
+                    else:
+                        pis[i], vs[i] = cached
+                indices = list(cache_keys)
+
+            if len(indices) == 0:
+                continue
+            if isinstance(planes, np.ndarray):
+                batch = planes if len(indices) == len(planes) else planes[indices]
+            else:
+                batch = np.stack([planes[i] for i in indices])
+            stats = self.search_stats
+            if stats is not None:
+                stats.add_batch(len(batch))
+                since = stats.clock()
+            pi, v = yield network, batch
+            if stats is not None:
+                stats.add('network', since)
+            pis[indices] = pi
+            vs[indices] = v
+
+            for i, (key, symmetry) in cache_keys.items():
+                self.eval_cache.put(key, symmetry, pis[i], vs[i])
+        return pis, vs
+
+    def _select(self, root, virtual_loss=0):
         """Select a node for expansion in the MCTS tree rooted at root
 
         Args:
             root (Node): the root of the MCTS tree
+            virtual_loss (float): virtual loss added to every walked edge as soon as it is chosen, so that the other
+                selections running at the same time avoid it
 
         Returns:
-            The selected node to be expanded
+            The selected node to be expanded (None if the path repeats a position), the (parent, slot) edges walked
+            from the root, starting with the edge holding the root statistics, and the undo records of the actions
+            played on the search board
         """
         n = root   
+        path = [(root.parent, root.action)]
+        undo_records = []
+        visited = {id(root)}
+        if virtual_loss:
+            self._add_virtual_loss(path, virtual_loss)
 
         while n.is_expanded:
-            new_node = self._best_child(n, self.search_board.legal_actions_array(), c=1)[0]  # this will create a new unexpanded node if needed
-
-            self.search_board.take_action(self.search_board.index_to_action(new_node.action))
-            n = new_node
-        return n
+            parent, parent_slot = path[-1]
+            with n.lock:
+                slot, _ = self._best_action(n, c=1, parent_visits=parent.child_N[parent_slot])
+                # child_W holds the value from the child's point of view, so a loss for n is a positive value
+                n.child_N[slot] += virtual_loss
+                n.child_W[slot] += virtual_loss
+
+            action = self.search_board.index_to_action(int(n.actions[slot]))
+            undo_records.append(self.search_board.take_action(action))
+            path.append((n, slot))
+            with n.lock:
+                if slot not in n.children:
+                    # created after taking the action, so that the node reflects the board it represents
+                    n.children[slot] = self._new_node(n, slot)
+            n = n.children[slot]
+
+            if self.transpositions:
+                if id(n) in visited:
+                    return None, path, undo_records
+                visited.add(id(n))
+        return n, path, undo_records
+
+    def _new_node(self, parent, slot):
+        """Create the node for the current search board, or share the existing one when transpositions are enabled"""
+        stats = self.search_stats
+        if stats is not None:
+            since = stats.clock()
+
+        if not self.transpositions:
+            node = Node(self.search_board, parent=parent, action=slot)
+        else:
+            with self.transposition_lock:
+                self.tt_lookups += 1
+                node = self.transposition_table.get(self.search_board.hash)
+                if node is None:
+                    node = Node(self.search_board, parent=parent, action=slot)
+                    self.transposition_table[self.search_board.hash] = node
+                else:
+                    self.tt_hits += 1
+
+        if stats is not None:
+            stats.add('legal_mask', since, within='select')     # called from _select only
+        return node
+
+    def tt_hit_rate(self):
+        """Fraction of new edges of the search that led to an already known position, i.e. a saved network call"""
+        return self.tt_hits / self.tt_lookups if self.tt_lookups > 0 else 0
+
+    def _tree_size(self, root):
+        """Number of nodes reachable from root"""
+        if self.transpositions:
+            return len(self.transposition_table)
+        size = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(node.children.values())
+        return size
 
         
     def _expand(self, node):
@@ -146,66 +685,75 @@ class AI:
         Returns:
             the value of this node
         """
-        if node.is_expanded:
-            raise RuntimeError("Node is already expanded")
-        
-        new_board_tensor = self.search_board.to_onehot_tensor()
-        if self.search_board.turn == self.player_color:
-            pi, v = self.alphazero(new_board_tensor)
-        else:
-            pi, v = self.opponent(new_board_tensor)
+        stats = self.search_stats
+        if stats is not None:
+            since = stats.clock()
+        planes = self.search_board.to_planes()
+        if stats is not None:
+            stats.add('encode', since)
+
+        pis, vs = self._evaluate_batch([planes], [self.search_board.turn])
         # v = 1 if node.turn == self.search_board.simulate_game() else -1       # uncomment to simulate values instead of using the network
-        if node.pi is None:
-            node.set_pi(pi.detach().numpy().ravel())
 
-        node.is_expanded = True
+        if stats is not None:
+            since = stats.clock()
+        self._set_expanded(node, pis[0])
+        if stats is not None:
+            stats.add('expand', since)
         
-        return v
+        return float(vs[0])
 
+    def _set_expanded(self, node, pi):
+        # another thread may have evaluated the same leaf in the meantime, the first result is kept
+        with node.lock:
+            if not node.is_expanded:
+                node.expand(pi)
 
-    def _backpropagate(self, node, value):
+
+    def _backpropagate(self, path, value, virtual_loss=0):
         """Backpropagate the result of the simulation up from the expanded node to the root
 
         Args:
-            node (Node): the expanded node
+            path (list): the (parent, slot) edges from the root to the expanded node, as returned by _select
             value (int): value of the expanded node's state
+            virtual_loss (float): the virtual loss added by _select, removed along the way
         """
-        while node.parent is not None:
-            node.N += 1
-            node.W += value
-            node = node.parent
+        # the statistics of a node are stored in its parent, on the edge that was walked: with transpositions
+        # a node can have many parents, so following node.parent would not retrace the path
+        for parent, slot in reversed(path):
+            with parent.lock:
+                parent.child_N[slot] += 1 - virtual_loss
+                parent.child_W[slot] += value - virtual_loss
             value = -value
 
 
-    def _best_child(self, parent, legal_actions, c=1):
+    def _best_action(self, parent, c=1, parent_visits=None):
         """Apply the UCT formula in order to determine the best child to visit (=== the best action to take)
 
         Args:
             parent (Node): the parent node from which to choose the action
             c (float): the exploration parameter in the UCT formula
+            parent_visits (float): visits of parent along the current path, parent.N if not given
+
+        Returns:
+            The slot of the best action and its UCT score
         """
-        sqrt_parent_visits = sqrt(parent.N)
+        sqrt_parent_visits = sqrt(parent.N if parent_visits is None else parent_visits)
 
         # The minus in the first term (Q value) is because the children win rates are with respect to the other player
+        # Only the legal actions have a slot, so no masking is needed
         puct_scores = - parent.child_W / (parent.child_N + 1e-5) + c * parent.pi * sqrt_parent_visits / (parent.child_N + 1)
-
-        puct_scores = np.where(legal_actions == 1, puct_scores, -9999)
             
-        best_action = np.argmax(puct_scores)
-
-        assert legal_actions[best_action] == 1
-
-        if best_action not in parent.children:
-            parent.children[best_action] = Node(self.search_board, parent=parent, action=best_action)
+        best_slot = np.argmax(puct_scores)
 
-        return parent.children[best_action], best_action, puct_scores[best_action]
+        return best_slot, puct_scores[best_slot]
 
 
-    def _generate_search_policy(self, root, legal_actions):
-        root.child_N = legal_actions * root.child_N       
+    def _generate_search_policy(self, root):
+        visits = root.to_dense(root.child_N)
         
         #TODO: add temperature
-        return root.child_N / np.sum(root.child_N)  # normalize visits
+        return visits / np.sum(visits)  # normalize visits
     
     def _add_dirichlet_noise(self, pi, legal_actions, eps=0.25, alpha=3):
         alphas = np.ones_like(legal_actions) * alpha
@@ -0,0 +1,297 @@
+import random
+
+from conversions import index_to_action, action_to_index
+from action_masks import indices_to_mask
+from BoardPlanes import BoardPlanes
+from utils import *
+import topology
+from zobrist import PIECE_KEYS, BLACK_KIND, WHITE_KIND, KING_KIND, BLACK_TO_MOVE_KEY, turn_key
+
+
+# Squares are indexed as y * GRID_COUNT + x, so bit i of a bitboard is the square (i % 9, i // 9)
+NUM_SQUARES = GRID_COUNT * GRID_COUNT
+
+def square_index(pos):
+    # positions may hold numpy integers (e.g. from index_to_action), which would overflow the 81 bit shifts
+    return int(pos[1]) * GRID_COUNT + int(pos[0])
+
+def square_pos(index):
+    return (index % GRID_COUNT, index // GRID_COUNT)
+
+def positions_to_mask(positions):
+    mask = 0
+    for pos in positions:
+        mask |= 1 << square_index(pos)
+    return mask
+
+CAMPS_MASK = positions_to_mask(CAMPS)
+ESCAPES_MASK = positions_to_mask(ESCAPES)
+CASTLE_INDEX = square_index(CASTLE)
+CASTLE_MASK = 1 << CASTLE_INDEX
+ADJ_CASTLE_MASK = positions_to_mask(ADJ_CASTLE)
+
+def _index_rays(pos, rays):
+    """Translate the topology rays of the square pos to (squares mask, reachable, reachable indices) tuples.
+
+    reachable maps every set of blockers on the ray, as a bitboard, to the positions of the ray before the first of
+    them, so a move generator cuts a ray with a single dict lookup. reachable indices maps them to the indices of the
+    same moves in the action space.
+    """
+    output = []
+    for ray in rays:
+        reachable, reachable_indices = {}, {}
+        indices = tuple(action_to_index(pos, end) for end in ray)
+        for blocked in range(1 << len(ray)):
+            blockers = positions_to_mask(end for k, end in enumerate(ray) if blocked >> k & 1)
+            n = (blocked & -blocked).bit_length() - 1 if blocked else len(ray)
+            reachable[blockers] = ray[:n]
+            reachable_indices[blockers] = indices[:n]
+        output.append((positions_to_mask(ray), reachable, reachable_indices))
+    return tuple(output)
+
+# The tables of topology translated to square indices, by player to move: only black pieces stand in the camps, and
+# they use the camp rays there
+SQUARE_POS = tuple(square_pos(i) for i in range(NUM_SQUARES))
+_PLAYER_RAYS = {
+    WHITE_PLAYER: tuple(topology.MOVE_RAYS[pos] for pos in SQUARE_POS),
+    BLACK_PLAYER: tuple(topology.CAMP_MOVE_RAYS[pos] if pos in topology.CAMPS_SET else topology.MOVE_RAYS[pos]
+                        for pos in SQUARE_POS),
+}
+PLAYER_MOVE_RAYS = {player: tuple(_index_rays(pos, rays) for pos, rays in zip(SQUARE_POS, square_rays))
+                    for player, square_rays in _PLAYER_RAYS.items()}
+# the first square of every ray of a square: a piece can move as long as one of them is empty
+PLAYER_FIRST_SQUARES = {player: tuple(positions_to_mask([ray[0] for ray in rays if ray]) for rays in square_rays)
+                        for player, square_rays in _PLAYER_RAYS.items()}
+CAPTURE_PAIRS = tuple(
+    tuple((square_index(mid), square_index(os)) for mid, os in topology.CAPTURE_PAIRS[square_pos(i)])
+    for i in range(NUM_SQUARES)
+)
+KING_SURROUND = {square_index(pos): positions_to_mask(squares) for pos, squares in topology.KING_SURROUND.items()}
+
+
+class BitBoard(BoardPlanes):
+    """Headless Tablut engine storing the position as integer bitboards.
+
+    It exposes the same game interface as Board (actions, take_action, check_end_game, to_onehot_tensor, write_planes,
+    legal_action_indices, legal_actions_array, index_to_action) but has no squares, pieces or pygame objects, so it is much
+    cheaper to search and to copy.
+    """
+
+    def __init__(self, configuration=None, turn=None):
+        if turn is None:
+            self.turn = WHITE_PLAYER
+        else:
+            self.turn = WHITE_PLAYER if turn == 'WHITE' else BLACK_PLAYER
+
+        self.black = 0      # black soldiers
+        self.white = 0      # white soldiers, the king is kept apart
+        self.king = None    # square index of the king
+        self.king_capture = False
+        self.hash = turn_key(self.turn)     # Zobrist hash, kept up to date by take_action
+        # take_action writes new planes and leaves the old ones to the undo record, they are never changed in place
+        self._init_planes()
+
+        self.setup_board(INITIAL_CONFIG if configuration is None else configuration)
+
+    def setup_board(self, configuration):
+        for y, row in enumerate(configuration):
+            for x, piece in enumerate(row):
+                i = square_index((x, y))
+                if piece == 'BLACK':
+                    self.black |= 1 << i
+                    self.hash ^= PIECE_KEYS[BLACK_KIND][i]
+                    self.planes[BLACK_KIND, y, x] = 1
+                elif piece == 'WHITE':
+                    self.white |= 1 << i
+                    self.hash ^= PIECE_KEYS[WHITE_KIND][i]
+                    self.planes[WHITE_KIND, y, x] = 1
+                elif piece == 'KING':
+                    self.king = i
+                    self.hash ^= PIECE_KEYS[KING_KIND][i]
+                    self.planes[KING_KIND, y, x] = 1
+
+    def copy(self):
+        other = BitBoard.__new__(BitBoard)
+        other.turn = self.turn
+        other.black = self.black
+        other.white = self.white
+        other.king = self.king
+        other.king_capture = self.king_capture
+        other.hash = self.hash
+        other.planes = self.planes.copy()
+        return other
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def to_configuration(self):
+        """Return the position in the same format accepted by Board and BitBoard constructors"""
+        configuration = []
+        for y in range(GRID_COUNT):
+            row = []
+            for x in range(GRID_COUNT):
+                i = square_index((x, y))
+                if i == self.king:
+                    row.append('KING')
+                elif self.white >> i & 1:
+                    row.append('WHITE')
+                elif self.black >> i & 1:
+                    row.append('BLACK')
+                else:
+                    row.append('EMPTY')
+            configuration.append(row)
+        return configuration
+
+    def occupied(self):
+        king = 0 if self.king is None else 1 << self.king
+        return self.black | self.white | king
+
+    def king_escaped(self):
+        return self.king is not None and (ESCAPES_MASK >> self.king) & 1 == 1
+
+    def king_captured(self):
+        return self.king_capture
+
+    def _own(self):
+        if self.turn == WHITE_PLAYER:
+            return self.white if self.king is None else self.white | (1 << self.king)
+        return self.black
+
+    # The move generators below walk the own pieces from the lowest bit and cut every ray of a piece through the
+    # reachable table of its blockers. They are written out in full rather than through a shared generator, they are
+    # the hottest code of the search.
+
+    def actions(self):
+        output = []
+        occupied = self.occupied()
+        move_rays = PLAYER_MOVE_RAYS[self.turn]
+        own = self._own()
+        while own:
+            low = own & -own
+            own ^= low
+            i = low.bit_length() - 1
+            moves = []
+            for mask, reachable, _ in move_rays[i]:
+                moves += reachable[occupied & mask]
+            if moves:
+                output.append([SQUARE_POS[i], moves])
+        return output
+
+    def legal_action_indices(self):
+        """The indices in the action space of the legal actions, in increasing order"""
+        indices = []
+        occupied = self.occupied()
+        move_rays = PLAYER_MOVE_RAYS[self.turn]
+        own = self._own()
+        while own:
+            low = own & -own
+            own ^= low
+            for mask, _, reachable_indices in move_rays[low.bit_length() - 1]:
+                indices += reachable_indices[occupied & mask]
+        indices.sort()
+        return indices
+
+    def has_actions(self):
+        free = ~self.occupied()
+        first_squares = PLAYER_FIRST_SQUARES[self.turn]
+        own = self._own()
+        while own:
+            low = own & -own
+            own ^= low
+            if first_squares[low.bit_length() - 1] & free:
+                return True
+        return False
+
+    def take_action(self, action):
+        """Play action on the board
+
+        Returns:
+            The previous (black, white, king, king_capture, hash, planes) state, to be passed to undo_action
+        """
+        record = (self.black, self.white, self.king, self.king_capture, self.hash, self.planes)
+        planes = self.planes = self.planes.copy()
+        pos_start, pos_end = action
+        start, end = square_index(pos_start), square_index(pos_end)
+
+        if self.king == start:
+            self.king = end
+            color, kind = WHITE, KING_KIND
+        elif (self.white >> start) & 1:
+            self.white ^= (1 << start) | (1 << end)
+            color, kind = WHITE, WHITE_KIND
+        else:
+            assert (self.black >> start) & 1
+            self.black ^= (1 << start) | (1 << end)
+            color, kind = BLACK, BLACK_KIND
+        self.hash ^= PIECE_KEYS[kind][start] ^ PIECE_KEYS[kind][end] ^ BLACK_TO_MOVE_KEY
+        planes[kind, start // GRID_COUNT, start % GRID_COUNT] = 0
+        planes[kind, end // GRID_COUNT, end % GRID_COUNT] = 1
+
+        if color == WHITE:
+            allies = self.white if self.king is None else self.white | (1 << self.king)
+            enemies = self.black
+        else:
+            allies = self.black
+            enemies = self.white
+
+        for mid, os in CAPTURE_PAIRS[end]:
+            if mid == self.king and color == BLACK:
+                if mid == CASTLE_INDEX:
+                    captured = (self.black & ADJ_CASTLE_MASK) == ADJ_CASTLE_MASK
+                elif (ADJ_CASTLE_MASK >> mid) & 1:
+                    captured = (self.black & KING_SURROUND[mid]) == KING_SURROUND[mid]
+                else:
+                    captured = (allies >> os) & 1 or (CAMPS_MASK >> os) & 1
+                if captured:
+                    self.king_capture = True
+                    self.king = None
+                    self.hash ^= PIECE_KEYS[KING_KIND][mid]
+                    planes[KING_KIND, mid // GRID_COUNT, mid % GRID_COUNT] = 0
+            elif (enemies >> mid) & 1:
+                if ((allies >> os) & 1 or
+                    os == CASTLE_INDEX or
+                    ((CAMPS_MASK >> os) & 1 and not (CAMPS_MASK >> mid) & 1)):
+                    if color == WHITE:
+                        self.black &= ~(1 << mid)
+                        self.hash ^= PIECE_KEYS[BLACK_KIND][mid]
+                        planes[BLACK_KIND, mid // GRID_COUNT, mid % GRID_COUNT] = 0
+                    else:
+                        self.white &= ~(1 << mid)
+                        self.hash ^= PIECE_KEYS[WHITE_KIND][mid]
+                        planes[WHITE_KIND, mid // GRID_COUNT, mid % GRID_COUNT] = 0
+
+        self.turn = 1 - self.turn
+        return record
+
+    def undo_action(self, record):
+        """Take back the move that returned record, which must be the last one played"""
+        self.black, self.white, self.king, self.king_capture, self.hash, self.planes = record
+        self.turn = 1 - self.turn
+
+    def check_end_game(self):
+        if self.king_captured():
+            return True, BLACK_PLAYER
+        elif self.king_escaped():
+            return True, WHITE_PLAYER
+
+        if not self.has_actions():
+            return True, 1 - self.turn
+        return False, None
+
+    def legal_actions_array(self):
+        return indices_to_mask(self.legal_action_indices())
+
+    def index_to_action(self, index):
+        return index_to_action(index)
+
+    def simulate_game(self):
+        while True:
+            end, winner = self.check_end_game()
+            if end:
+                return winner
+
+            possible_actions = self.actions()
+            i = random.randint(0, len(possible_actions)-1)
+            j = random.randint(0, len(possible_actions[i][1])-1)
+            action = [possible_actions[i][0], possible_actions[i][1][j]]
+            self.take_action(action)
@@ -1,13 +1,25 @@
 import pygame
 import random
-import numpy as np
-import torch
+from typing import NamedTuple
 
 from Square import Square
 from Piece import Piece
+from conversions import index_to_action, action_to_index
+from action_masks import indices_to_mask
+from zobrist import piece_key, turn_key, BLACK_TO_MOVE_KEY
+from BoardPlanes import BoardPlanes
 from utils import *
 
-class Board:
+class UndoRecord(NamedTuple):
+    """Everything Board.undo_action needs to take back a move"""
+    piece: Piece
+    pos_start: tuple
+    captured: list      # (square, piece) pairs removed by the move
+    king_square: Square
+    king_capture: bool
+    hash: int
+
+class Board(BoardPlanes):
     def __init__(self, width, height, configuration=None, turn=None):
         self.width = width
         self.height = height
@@ -25,6 +37,8 @@ class Board:
         self.king_capture = False
 
         self.squares = self.generate_squares()
+        self.hash = turn_key(self.turn)     # Zobrist hash, kept up to date by Piece.place and every change of turn
+        self._init_planes()
         if configuration is None:
             self.setup_board(INITIAL_CONFIG)
         else:
@@ -52,13 +66,15 @@ class Board:
     def setup_board(self, configuration):
         for y, row in enumerate(configuration):
             for x, piece in enumerate(row):
-                if piece != 'EMPTY':
+                if piece != 'EMPTY' and piece != 'THRONE':   # the server marks the empty castle as THRONE
                     square = self.get_square_from_pos((x, y))
                     square.occupying_piece = Piece(
-                        (x, y), WHITE if piece == 'WHITE' or piece == 'KING' else BLACK
+                        (x, y), WHITE if piece == 'WHITE' or piece == 'KING' else BLACK, king=piece == 'KING'
                     )
                     if piece == 'KING':
                         self.king_square = square
+                    self.hash ^= piece_key(square.occupying_piece.zobrist_kind(), (x, y))
+                    self.planes[square.occupying_piece.zobrist_kind(), y, x] = 1
 
     def handle_click(self, mx, my):
         x = mx // self.tile_width
@@ -70,6 +86,7 @@ class Board:
                     self.selected_piece = clicked_square.occupying_piece
         elif self.selected_piece.move(self, clicked_square):
             self.turn = 1 - self.turn
+            self.hash ^= BLACK_TO_MOVE_KEY
         elif clicked_square.occupying_piece is not None:
             if clicked_square.occupying_piece.color == self.turn:
                 self.selected_piece = clicked_square.occupying_piece
@@ -129,11 +146,41 @@ class Board:
         return output      
 
     def take_action(self, action):
+        """Play action on the board
+
+        Returns:
+            An UndoRecord that can be passed to undo_action to restore the previous position
+        """
         pos_start, pos_end = action
-        successful = self.get_piece_from_pos(pos_start).move(self, self.get_square_from_pos(pos_end))
-        assert successful
-        if successful:
-            self.turn = 1 - self.turn
+        piece = self.get_piece_from_pos(pos_start)
+        square = self.get_square_from_pos(pos_end)
+        assert square in piece.get_moves(self)
+
+        record_fields = (self.king_square, self.king_capture, self.hash)
+        captured = piece.place(self, square)
+        self.turn = 1 - self.turn
+        self.hash ^= BLACK_TO_MOVE_KEY
+        return UndoRecord(piece, pos_start, captured, *record_fields)
+
+    def undo_action(self, record):
+        """Take back the move that returned record, which must be the last one played"""
+        piece = record.piece
+        kind = piece.zobrist_kind()
+        self.get_square_from_pos(piece.pos).occupying_piece = None
+        self.planes[kind, piece.y, piece.x] = 0
+        start_square = self.get_square_from_pos(record.pos_start)
+        start_square.occupying_piece = piece
+        piece.pos, piece.x, piece.y = start_square.pos, start_square.x, start_square.y
+        self.planes[kind, piece.y, piece.x] = 1
+
+        for square, captured_piece in record.captured:
+            square.occupying_piece = captured_piece
+            self.planes[captured_piece.zobrist_kind(), square.y, square.x] = 1
+
+        self.king_square = record.king_square
+        self.king_capture = record.king_capture
+        self.hash = record.hash
+        self.turn = 1 - self.turn
 
 
     def check_end_game(self):
@@ -147,71 +194,16 @@ class Board:
         return False, None
 
     
-    def to_onehot_tensor(self):
-        tensor = np.zeros((3, 9, 9))     # index 0 for black, 1 for white and 2 for king
-        for x in range(9):
-            for y in range(9):
-                piece = self.get_piece_from_pos((x, y))
-                if piece is None:
-                    continue
-                
-                i = None
-                if piece.king: 
-                    i = 2
-                elif piece.color == WHITE:
-                    i = 1
-                elif piece.color == BLACK:
-                    i = 0
-                
-                if i is not None:
-                    tensor[i, y, x] = 1
-        return torch.from_numpy(tensor).float().unsqueeze(0)
-    
-    def legal_actions_array(self):
-        tensor = np.zeros((9, 9, 32))   # 4 (num dirs) * 8 (max ray) = 32
-        
+    def legal_action_indices(self):
+        return sorted(action_to_index(start, end) for start, ends in self.actions() for end in ends)
+
 
-        actions = self.actions()
-        for pos_start, pos_ends in actions:
-            for pos_end in pos_ends:
-                
-                if pos_start[0] == pos_end[0]:
-                    i = pos_end[1] - pos_start[1]
-                    i -= 1 if i > 0 else 0
-                    i += 8
-
-                elif pos_start[1] == pos_end[1]:
-                    i = pos_end[0] - pos_start[0]
-                    i -= 1 if i > 0 else 0
-                    i += 8 + 16
-                
-                else:
-                    raise ValueError
-                
-                tensor[pos_start[0], pos_start[1], i] = 1
-
-        tensor = tensor.ravel()     # flatten tensor
-        return tensor
+    def legal_actions_array(self):
+        return indices_to_mask(self.legal_action_indices())
     
     
     def index_to_action(self, index):
-        z = index % 32
-        index //= 32
-        y = index % 9
-        index //= 9
-        x = index
-
-        if z >= 16:
-            z -= 16 + 8
-            z += 1 if z >= 0 else 0
-            pos_start = (x, y)
-            pos_end = (x + z, y)
-        else:
-            z -= 8
-            z += 1 if z >= 0 else 0
-            pos_start = (x, y)
-            pos_end = (x, y + z)
-        return pos_start, pos_end
+        return index_to_action(index)
 
 
     def simulate_game(self):
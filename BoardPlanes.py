@@ -0,0 +1,29 @@
+import numpy as np
+import torch
+
+from utils import *
+
+
+class BoardPlanes:
+    """Network input planes of Board and BitBoard, kept up to date move by move like the Zobrist hash
+
+    self.planes holds the (3, 9, 9) planes of the position: 0 black, 1 white and 2 king, indexed by [y, x]. The
+    Zobrist kind of a piece is its plane. The engine creates them with _init_planes and updates them as it plays.
+    """
+
+    def _init_planes(self):
+        self.planes = np.zeros((3, GRID_COUNT, GRID_COUNT), dtype=np.float32)
+
+    def to_planes(self):
+        # a copy, the planes of the board change with the next move. Read self.planes for a view
+        return self.planes.copy()
+
+    def write_planes(self, out, i):
+        """Copy the planes into slot i of out, a (B, 3, 9, 9) array or tensor, e.g. a batch being filled"""
+        if isinstance(out, torch.Tensor):
+            out[i].copy_(torch.from_numpy(self.planes))
+        else:
+            out[i] = self.planes
+
+    def to_onehot_tensor(self):
+        return torch.from_numpy(self.to_planes()).unsqueeze(0)
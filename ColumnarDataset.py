@@ -0,0 +1,73 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from replay_buffer import unpack_states, dense_policies
+from symmetries import ACTION_PERMUTATIONS, transform_planes_batch, random_symmetries
+from utils import *
+
+
+class ColumnarDataset(Dataset):
+    """Training positions stored as contiguous columns of compact arrays, expanded to tensors a whole batch at a time
+
+    An item is only its index: collate gathers the rows of the batch and builds the float32 planes and the dense
+    policy targets, so the dense arrays exist for one batch only and the DataLoader workers receive just the columns.
+    With data augmentation every position of the batch is also seen under a random symmetry of the board, applied to
+    the planes and the targets through the permutation tables of symmetries.py. Use it with collate_fn=dataset.collate.
+
+    Args:
+        boards (np.ndarray): (N, PACKED_STATE_BYTES) bit-packed planes, as written by replay_buffer.pack_states
+        values (np.ndarray): (N,) results for the player to move
+        actions (np.ndarray): (N,) index of the move played, the target is then one-hot
+        policy_indices (np.ndarray): (N, K) actions of sparse search policies, -1 for the unused pairs, as written by
+            replay_buffer.sparse_policies
+        policy_probs (np.ndarray): (N, K) probabilities of the actions in policy_indices
+        rows (np.ndarray): the rows of the columns making up the dataset, all of them if not given
+        data_augmentation (bool): apply a random board symmetry to every position of a batch
+    """
+
+    def __init__(self, boards, values, actions=None, policy_indices=None, policy_probs=None, rows=None,
+                 data_augmentation=True):
+        super().__init__()
+        assert (actions is None) != (policy_indices is None), "Give either the actions or the sparse policies"
+        self.boards = np.ascontiguousarray(boards, dtype=np.uint8)
+        self.values = np.ascontiguousarray(values)
+        self.actions = None if actions is None else np.ascontiguousarray(actions, dtype=np.int16)
+        self.policy_indices = None if policy_indices is None else np.ascontiguousarray(policy_indices, dtype=np.int16)
+        self.policy_probs = None if policy_probs is None else np.ascontiguousarray(policy_probs, dtype=np.float16)
+        self.rows = np.arange(len(self.boards)) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.data_augmentation = data_augmentation
+
+    @classmethod
+    def from_corpus(cls, corpus, player, data_augmentation=True):
+        """The positions of a Corpus with player to move"""
+        return cls(corpus.boards, corpus.values, actions=corpus.actions,
+                   rows=np.flatnonzero(np.asarray(corpus.turns) == player), data_augmentation=data_augmentation)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return idx
+
+    def nbytes(self):
+        """Memory of the columns"""
+        columns = [self.boards, self.values, self.actions, self.policy_indices, self.policy_probs, self.rows]
+        return sum(column.nbytes for column in columns if column is not None)
+
+    def collate(self, batch):
+        """Build the (states, pis, values) tensors of a batch of indices"""
+        rows = self.rows[np.asarray(batch)]
+        n = len(rows)
+        symmetries = random_symmetries(n) if self.data_augmentation else np.zeros(n, dtype=np.int64)
+
+        states = transform_planes_batch(unpack_states(self.boards[rows]), symmetries)
+
+        if self.actions is not None:
+            pis = np.zeros((n, NUM_ACTIONS), dtype=np.float32)
+            pis[np.arange(n), ACTION_PERMUTATIONS[symmetries, self.actions[rows]]] = 1
+        else:
+            pis = dense_policies(self.policy_indices[rows], self.policy_probs[rows], symmetries)
+
+        return (torch.from_numpy(states), torch.from_numpy(pis),
+                torch.from_numpy(self.values[rows].astype(np.float32)))
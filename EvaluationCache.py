@@ -0,0 +1,69 @@
+import collections
+import threading
+import numpy as np
+
+from symmetries import canonical_form, transform_policy, untransform_policy
+from utils import *
+
+
+class EvaluationCache:
+    """Bounded LRU cache of network evaluations, shared by the positions that are symmetric to each other.
+
+    Positions are keyed by their canonical form under the 8 symmetries of the board, and the policy is stored in the
+    canonical orientation, so a position symmetric to a cached one is a hit too: its policy is mapped back through
+    the action permutation. The cached values are only valid for the weights they were computed with, so the cache
+    must be cleared whenever a network is trained.
+    """
+
+    # bytes of an entry: the float32 policy, the canonical key and the bookkeeping of the dictionary
+    ENTRY_BYTES = NUM_ACTIONS * 4 + 300
+
+    def __init__(self, max_megabytes=256):
+        self.max_entries = max(1, int(max_megabytes * 2**20) // self.ENTRY_BYTES)
+        self.entries = collections.OrderedDict()    # least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, network, planes):
+        """Return the cache key of planes evaluated by network and the symmetry sending planes to the canonical form"""
+        canonical, symmetry = canonical_form(planes)
+        return (id(network), canonical), symmetry
+
+    def get(self, key, symmetry):
+        """Return the cached (pi, v) of the position with the given key and symmetry, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        pi, v = entry
+        # pi is in the canonical orientation, bring it back to the one of the position
+        return untransform_policy(pi, symmetry), v
+
+    def put(self, key, symmetry, pi, v):
+        """Store the evaluation (pi, v) of the position with the given key and symmetry"""
+        canonical_pi = transform_policy(pi, symmetry).astype(np.float32)
+        with self.lock:
+            self.entries[key] = (canonical_pi, float(v))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def stats(self):
+        """Counters of the cache, cumulative since its creation"""
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()}
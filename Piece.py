@@ -1,55 +1,36 @@
 import pygame
 
 from utils import *
+from topology import RAYS, CAPTURE_PAIRS, KING_SURROUND, move_rays
+from zobrist import piece_key, BLACK_KIND, WHITE_KIND, KING_KIND
 
 class Piece:
-    def __init__(self, pos, color):
+    def __init__(self, pos, color, king=False):
         self.pos = pos
         self.x = pos[0]
         self.y = pos[1]
         self.color = color
-        self.king = True if (self.x, self.y) == CASTLE else False
+        self.king = king
+
+    def zobrist_kind(self):
+        if self.king:
+            return KING_KIND
+        return WHITE_KIND if self.color == WHITE else BLACK_KIND
 
     def get_possible_moves(self, board):
-        output = []
-        moves_north = []
-        for y in range(self.y)[::-1]:
-            moves_north.append(board.get_square_from_pos(
-                (self.x, y)
-            ))
-        output.append(moves_north)
-        moves_east = []
-        for x in range(self.x + 1, GRID_COUNT):
-            moves_east.append(board.get_square_from_pos(
-                (x, self.y)
-            ))
-        output.append(moves_east)
-        moves_south = []
-        for y in range(self.y + 1, GRID_COUNT):
-            moves_south.append(board.get_square_from_pos(
-                (self.x, y)
-            ))
-        output.append(moves_south)
-        moves_west = []
-        for x in range(self.x)[::-1]:
-            moves_west.append(board.get_square_from_pos(
-                (x, self.y)
-            ))
-        output.append(moves_west)
-        return output
+        return [[board.squares[y][x] for x, y in ray] for ray in RAYS[self.pos]]
     
 
     def get_moves(self, board):
-        prev_square = board.get_square_from_pos(self.pos)
+        # the rays are already cut at the castle and at the camps this piece cannot enter
+        squares = board.squares
         output = []
-        for direction in self.get_possible_moves(board):
-            for square in direction:
-                if (square.occupying_piece is not None or 
-                    square.type == CASTLE_TYPE or 
-                    (square.type == CAMP_TYPE and (self.color == WHITE or prev_square.type != CAMP_TYPE))):
+        for ray in move_rays(self.pos, self.color):
+            for x, y in ray:
+                square = squares[y][x]
+                if square.occupying_piece is not None:
                     break
-                else:
-                    output.append(square)
+                output.append(square)
         return output
     
     
@@ -59,47 +40,69 @@ class Piece:
                 j.highlight = False
 
         if square in self.get_moves(board):   # perform movement
-            prev_square = board.get_square_from_pos(self.pos)
-            self.pos, self.x, self.y = square.pos, square.x, square.y
-            prev_square.occupying_piece = None
-            square.occupying_piece = self
             board.selected_piece = None
-
-            if self.king:
-                board.king_square = square
-
-            for d in DIRS:
-                # mid stands for "middle", os stands for "other side"
-                mid_pos = [self.x + d[0], self.y + d[1]]
-                os_pos = [self.x + 2*d[0], self.y + 2*d[1]]
-                if board.is_inside(mid_pos) and board.is_inside(os_pos):
-                    mid_square = board.get_square_from_pos(mid_pos)
-                    mid_piece = mid_square.occupying_piece
-                    os_square = board.get_square_from_pos(os_pos)
-                    os_piece = os_square.occupying_piece
-                    if mid_piece is not None and mid_piece.color != self.color:
-                        if mid_piece.king:
-                            if mid_square.pos == CASTLE:
-                                pieces = [board.get_piece_from_pos(p) for p in ADJ_CASTLE]
-                                if all(p is not None and p.color == BLACK for p in pieces):
-                                    board.king_capture = True
-                                    mid_square.occupying_piece = None
-                            elif mid_square.type == ADJ_CASTLE_TYPE:
-                                if all(((sq.occupying_piece is not None and sq.occupying_piece.color == BLACK) or sq.type == CASTLE_TYPE) for sq in mid_square.adj_squares(board)): 
-                                    board.king_capture = True
-                                    mid_square.occupying_piece = None
-                            elif (os_piece is not None and os_piece.color == self.color) or os_square.type == CAMP_TYPE:
-                                board.king_capture = True
-                                mid_square.occupying_piece = None
-                            
-                        else:
-                            if ((os_piece is not None and os_piece.color == self.color) or 
-                                os_square.type == CASTLE_TYPE or 
-                                (os_square.type == CAMP_TYPE and mid_square.type != CAMP_TYPE)):
-                                mid_square.occupying_piece = None
-
+            self.place(board, square)
             return True
         
         else:   # reset selection
             board.selected_piece = None
-            return False
\ No newline at end of file
+            return False
+
+    def place(self, board, square):
+        """Move the piece to square, which must be a legal destination, and resolve the captures.
+        The board hash and planes are updated for the move and the captures, the hash not for the change of turn
+
+        Returns:
+            The list of (square, piece) pairs captured by the move
+        """
+        prev_square = board.get_square_from_pos(self.pos)
+        kind = self.zobrist_kind()
+        board.hash ^= piece_key(kind, self.pos) ^ piece_key(kind, square.pos)
+        board.planes[kind, self.y, self.x] = 0
+        self.pos, self.x, self.y = square.pos, square.x, square.y
+        board.planes[kind, self.y, self.x] = 1
+        prev_square.occupying_piece = None
+        square.occupying_piece = self
+
+        if self.king:
+            board.king_square = square
+
+        captured = []
+        squares = board.squares
+        # mid stands for "middle", os stands for "other side"
+        for mid_pos, os_pos in CAPTURE_PAIRS[self.pos]:
+            mid_square = squares[mid_pos[1]][mid_pos[0]]
+            mid_piece = mid_square.occupying_piece
+            if mid_piece is None or mid_piece.color == self.color:
+                continue
+            os_square = squares[os_pos[1]][os_pos[0]]
+            os_piece = os_square.occupying_piece
+            if mid_piece.king:
+                if mid_pos == CASTLE:
+                    pieces = [board.get_piece_from_pos(p) for p in ADJ_CASTLE]
+                    if all(p is not None and p.color == BLACK for p in pieces):
+                        board.king_capture = True
+                        captured.append((mid_square, mid_piece))
+                        mid_square.occupying_piece = None
+                elif mid_square.type == ADJ_CASTLE_TYPE:
+                    pieces = [board.get_piece_from_pos(p) for p in KING_SURROUND[mid_pos]]
+                    if all(p is not None and p.color == BLACK for p in pieces):
+                        board.king_capture = True
+                        captured.append((mid_square, mid_piece))
+                        mid_square.occupying_piece = None
+                elif (os_piece is not None and os_piece.color == self.color) or os_square.type == CAMP_TYPE:
+                    board.king_capture = True
+                    captured.append((mid_square, mid_piece))
+                    mid_square.occupying_piece = None
+
+            else:
+                if ((os_piece is not None and os_piece.color == self.color) or
+                    os_square.type == CASTLE_TYPE or
+                    (os_square.type == CAMP_TYPE and mid_square.type != CAMP_TYPE)):
+                    captured.append((mid_square, mid_piece))
+                    mid_square.occupying_piece = None
+
+        for captured_square, captured_piece in captured:
+            board.hash ^= piece_key(captured_piece.zobrist_kind(), captured_square.pos)
+            board.planes[captured_piece.zobrist_kind(), captured_square.y, captured_square.x] = 0
+        return captured
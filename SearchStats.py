@@ -0,0 +1,90 @@
+import collections
+import json
+import threading
+import time
+
+
+class SearchStats:
+    """Where the time of one search went, filled by AI when instrumentation is enabled
+
+    Every phase accumulates its wall clock time and the CPU time of the threads running it. The phases are:
+        copy        copy of the board for every search thread
+        select      descent of the tree, without the node creation below
+        legal_mask  creation of the new nodes, the root included: end of game check and legal actions
+        encode      planes of the leaves for the network
+        network     forward passes, the lookups of the evaluation cache are left out
+        expand      priors set in the expanded nodes
+        backprop    backup of the values and undo of the moves on the search board
+    With several threads the phase times are summed over the threads, so they can exceed the wall time of the search.
+    """
+
+    PHASES = ('copy', 'select', 'legal_mask', 'encode', 'network', 'expand', 'backprop')
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.wall = dict.fromkeys(self.PHASES, 0.0)
+        self.cpu = dict.fromkeys(self.PHASES, 0.0)
+        self.batch_sizes = collections.Counter()    # positions per network call
+        self.max_depth = 0
+        self.simulations = 0
+        self.tree_size = 0
+        self.search_wall = 0.0
+        self.search_cpu = 0.0
+        self.lock = threading.Lock()
+        self._search_clock = self.clock()
+
+    @staticmethod
+    def clock():
+        return time.perf_counter(), time.thread_time()
+
+    def add(self, phase, since, within=None):
+        """Add the time passed since the clock() reading since to phase
+
+        Args:
+            within (str): the phase whose timer is still running around this one, the time is taken out of it so
+                that it is not counted twice
+        """
+        wall, cpu = time.perf_counter() - since[0], time.thread_time() - since[1]
+        with self.lock:
+            self.wall[phase] += wall
+            self.cpu[phase] += cpu
+            if within is not None:
+                self.wall[within] -= wall
+                self.cpu[within] -= cpu
+
+    def add_batch(self, size):
+        with self.lock:
+            self.batch_sizes[size] += 1
+
+    def add_depth(self, depth):
+        if depth > self.max_depth:
+            with self.lock:
+                self.max_depth = max(self.max_depth, depth)
+
+    def finish(self, simulations, tree_size):
+        """Close the search, called by the thread that started it"""
+        self.search_wall = time.perf_counter() - self._search_clock[0]
+        self.search_cpu = time.thread_time() - self._search_clock[1]
+        self.simulations = simulations
+        self.tree_size = tree_size
+
+    def to_dict(self):
+        network_calls = sum(self.batch_sizes.values())
+        return {'time': self.start_time, 'wall': self.search_wall, 'cpu': self.search_cpu,
+                'simulations': self.simulations,
+                'simulations_per_second': self.simulations / self.search_wall if self.search_wall > 0 else 0,
+                'tree_size': self.tree_size, 'max_depth': self.max_depth,
+                'phases_wall': dict(self.wall), 'phases_cpu': dict(self.cpu),
+                'network_calls': network_calls,
+                'mean_batch_size': sum(s * n for s, n in self.batch_sizes.items()) / max(1, network_calls),
+                'batch_sizes': {str(s): n for s, n in sorted(self.batch_sizes.items())}}
+
+    def write(self, path):
+        """Append the stats as one JSON line to the file at path"""
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.to_dict()) + '\n')
+
+    def __str__(self):
+        phases = ', '.join(f"{phase} {self.wall[phase]:.2f}s" for phase in self.PHASES)
+        return (f"{self.simulations} simulations in {self.search_wall:.2f}s, {self.tree_size} nodes, "
+                f"depth {self.max_depth}, {phases}")
@@ -1,6 +1,7 @@
 import pygame
 
 from utils import *
+from topology import RAYS
 
 class Square:
     def __init__(self, x, y, width, height):
@@ -26,14 +27,14 @@ class Square:
             self.type = CASTLE_TYPE
             self.draw_color = (255, 140, 26)
             self.highlight_color = (0, 255, 0)
+        elif self.pos in ADJ_CASTLE:    # must come before DEFENSES, which contains these squares as well
+            self.type = ADJ_CASTLE_TYPE
+            self.draw_color = (255, 204, 255)
+            self.highlight_color = (0, 255, 0)
         elif self.pos in DEFENSES:
             self.type = DEFENSE_TYPE
             self.draw_color = (255, 204, 255)
             self.highlight_color = (0, 255, 0)
-        elif self.pos in ADJ_CASTLE:
-            self.type = ADJ_CASTLE_TYPE
-            self.draw_color = (255, 212, 128)
-            self.highlight = (0, 255, 0)
         else:
             self.type = None
             self.draw_color = (255, 212, 128)
@@ -72,29 +73,4 @@ class Square:
         return [board.get_square_from_pos([self.x + d[0], self.y + d[1]]) for d in DIRS]
     
     def get_possible_moves(self, board):
-        output = []
-        moves_north = []
-        for y in range(self.y)[::-1]:
-            moves_north.append(board.get_square_from_pos(
-                (self.x, y)
-            ))
-        output.append(moves_north)
-        moves_east = []
-        for x in range(self.x + 1, GRID_COUNT):
-            moves_east.append(board.get_square_from_pos(
-                (x, self.y)
-            ))
-        output.append(moves_east)
-        moves_south = []
-        for y in range(self.y + 1, GRID_COUNT):
-            moves_south.append(board.get_square_from_pos(
-                (self.x, y)
-            ))
-        output.append(moves_south)
-        moves_west = []
-        for x in range(self.x)[::-1]:
-            moves_west.append(board.get_square_from_pos(
-                (x, self.y)
-            ))
-        output.append(moves_west)
-        return output
\ No newline at end of file
+        return [[board.squares[y][x] for x, y in ray] for ray in RAYS[self.pos]]
@@ -0,0 +1,189 @@
+import numpy as np
+import torch
+
+from action_masks import NUM_SQUARES, OUTSIDE, legal_actions_masks
+from conversions import index_to_action
+from utils import *
+import topology
+
+
+# Squares are flattened in the [y, x] order of the planes (y * 9 + x), unlike the x-major order of action_masks,
+# plus the OUTSIDE square standing for everything beyond the edge of the board: it is always empty here, so the
+# tables can point there when a square does not exist
+
+def ymajor_index(pos):
+    if not (0 <= pos[0] < GRID_COUNT and 0 <= pos[1] < GRID_COUNT):
+        return OUTSIDE
+    return pos[1] * GRID_COUNT + pos[0]
+
+def _ymajor_mask(positions):
+    mask = np.zeros(NUM_SQUARES + 1, dtype=bool)
+    for pos in positions:
+        mask[ymajor_index(pos)] = True
+    return mask
+
+_YMAJOR_CAMPS_FLAT = _ymajor_mask(CAMPS)
+_YMAJOR_ESCAPES_FLAT = _ymajor_mask(ESCAPES)
+_YMAJOR_CASTLE = ymajor_index(CASTLE)
+
+# start and end square of every action, the ends beyond the edge (never legal) go to OUTSIDE
+ACTION_START = np.array([ymajor_index(index_to_action(a)[0]) for a in range(NUM_ACTIONS)])
+ACTION_END = np.array([ymajor_index(index_to_action(a)[1]) for a in range(NUM_ACTIONS)])
+
+def _capture_tables():
+    # for every landing square the (middle, other side) squares of the sandwiches it can close, one per direction
+    mid = np.full((NUM_SQUARES + 1, len(DIRS)), OUTSIDE)
+    other = np.full((NUM_SQUARES + 1, len(DIRS)), OUTSIDE)
+    for pos in topology.POSITIONS:
+        for k, (m, o) in enumerate(topology.CAPTURE_PAIRS[pos]):
+            mid[ymajor_index(pos), k] = ymajor_index(m)
+            other[ymajor_index(pos), k] = ymajor_index(o)
+    return mid, other
+
+CAPTURE_MID, CAPTURE_OTHER = _capture_tables()
+
+def _king_surround_tables():
+    # squares that must hold black pieces to capture the king on the castle or next to it, instead of a sandwich
+    squares = np.full((NUM_SQUARES + 1, 4), OUTSIDE)
+    count = np.zeros(NUM_SQUARES + 1, dtype=np.int64)
+    special = {CASTLE: tuple(ADJ_CASTLE), **topology.KING_SURROUND}
+    for pos, surround in special.items():
+        squares[ymajor_index(pos), :len(surround)] = [ymajor_index(q) for q in surround]
+        count[ymajor_index(pos)] = len(surround)
+    return squares, count
+
+KING_SURROUND, KING_SURROUND_COUNT = _king_surround_tables()
+
+
+class VecBoard:
+    """B Tablut games stored as stacked NumPy arrays and played in lockstep.
+
+    It follows the same rules as Board and BitBoard, but every operation works on all the games at once: legal action
+    masks, moves with their captures and end of game detection. It has no undo, it is meant to generate games.
+    """
+
+    def __init__(self, num_games, configurations=None, turns=None):
+        self.num_games = num_games
+
+        # pieces[g, k, q] tells whether game g has a piece of kind k (0 black, 1 white, 2 king, as in the planes)
+        # on square q, the last column is OUTSIDE and stays empty
+        self.pieces = np.zeros((num_games, 3, NUM_SQUARES + 1), dtype=bool)
+        self.turns = np.full(num_games, WHITE_PLAYER)
+        self.king_captured = np.zeros(num_games, dtype=bool)
+
+        for g in range(num_games):
+            self.set_game(g, INITIAL_CONFIG if configurations is None else configurations[g],
+                          None if turns is None else turns[g])
+
+    def set_game(self, g, configuration, turn=None):
+        """Set game g to a configuration in the format accepted by Board and BitBoard"""
+        self.pieces[g] = False
+        for y, row in enumerate(configuration):
+            for x, piece in enumerate(row):
+                if piece == 'BLACK':
+                    self.pieces[g, 0, ymajor_index((x, y))] = True
+                elif piece == 'WHITE':
+                    self.pieces[g, 1, ymajor_index((x, y))] = True
+                elif piece == 'KING':
+                    self.pieces[g, 2, ymajor_index((x, y))] = True
+        self.turns[g] = WHITE_PLAYER if turn is None or turn == 'WHITE' else BLACK_PLAYER
+        self.king_captured[g] = False
+
+    def to_configuration(self, g):
+        """Return game g in the format accepted by Board and BitBoard constructors"""
+        names = np.full(NUM_SQUARES, 'EMPTY', dtype=object)
+        for kind, name in enumerate(['BLACK', 'WHITE', 'KING']):
+            names[self.pieces[g, kind, :NUM_SQUARES]] = name
+        return names.reshape(GRID_COUNT, GRID_COUNT).tolist()
+
+    def select_games(self, games):
+        """A new VecBoard holding copies of the given games, a game given twice is copied twice"""
+        other = VecBoard.__new__(VecBoard)
+        other.num_games = len(games)
+        other.pieces = self.pieces[games]
+        other.turns = self.turns[games]
+        other.king_captured = self.king_captured[games]
+        return other
+
+    def to_planes(self):
+        """The (B, 3, 9, 9) network input of all the games"""
+        return self.pieces[:, :, :NUM_SQUARES].reshape(self.num_games, 3, GRID_COUNT, GRID_COUNT).astype(np.float32)
+
+    def to_onehot_tensor(self):
+        return torch.from_numpy(self.to_planes())
+
+    def legal_actions_masks(self):
+        """The (B, NUM_ACTIONS) boolean masks of the legal actions of every game"""
+        return legal_actions_masks(self.to_planes(), self.turns)
+
+    def take_actions(self, actions):
+        """Play one action in every game
+
+        Args:
+            actions (array-like): B action indices, a negative index leaves its game untouched (e.g. a game over)
+        """
+        actions = np.asarray(actions)
+        games = np.flatnonzero(actions >= 0)
+        start = ACTION_START[actions[games]]
+        end = ACTION_END[actions[games]]
+
+        kinds = self.pieces[games, :, start].argmax(axis=1)
+        self.pieces[games, kinds, start] = False
+        self.pieces[games, kinds, end] = True
+
+        self._resolve_captures(games, end)
+        self.turns[games] = 1 - self.turns[games]
+
+    def _resolve_captures(self, games, end):
+        """Remove the pieces captured by the pieces that just landed on the squares end of games"""
+        black_moved = (self.turns[games] == BLACK_PLAYER)[:, np.newaxis]
+        pieces = self.pieces[games]
+        black, white, king = pieces[:, 0], pieces[:, 1], pieces[:, 2]
+        rows = np.arange(len(games))[:, np.newaxis]
+
+        mid = CAPTURE_MID[end]      # (n, 4)
+        other = CAPTURE_OTHER[end]
+
+        # soldiers: sandwiched between the moved piece and an ally (the king helps white), the castle or a camp,
+        # except that a soldier standing in a camp is safe from the camps
+        allies = np.where(black_moved, black, white | king)
+        enemies = np.where(black_moved, white, black)
+        soldiers = enemies[rows, mid] & (allies[rows, other] | (other == _YMAJOR_CASTLE) |
+                                         (_YMAJOR_CAMPS_FLAT[other] & ~_YMAJOR_CAMPS_FLAT[mid]))
+
+        # king: surrounded on every free side on the castle or next to it, sandwiched by black or a camp elsewhere
+        surround_count = KING_SURROUND_COUNT[mid]
+        surrounded = black[rows[:, :, np.newaxis], KING_SURROUND[mid]].sum(axis=2) == surround_count
+        sandwiched = black[rows, other] | _YMAJOR_CAMPS_FLAT[other]
+        king_taken = black_moved & king[rows, mid] & np.where(surround_count > 0, surrounded, sandwiched)
+
+        g, d = np.nonzero(soldiers)
+        self.pieces[games[g], np.where(black_moved[g, 0], 1, 0), mid[g, d]] = False
+
+        taken = games[king_taken.any(axis=1)]
+        self.pieces[taken, 2] = False
+        self.king_captured[taken] = True
+
+    def check_end_games(self, legal_masks=None):
+        """Check which games are over, as Board.check_end_game does for a single game
+
+        Args:
+            legal_masks (np.ndarray): the masks returned by legal_actions_masks for the current positions, computed
+                here if not given
+
+        Returns:
+            A (B,) boolean array of the games that are over and a (B,) array with their winners, -1 for the others
+        """
+        ended = self.king_captured.copy()
+        winners = np.where(ended, BLACK_PLAYER, -1)
+
+        escaped = ~ended & (self.pieces[:, 2] & _YMAJOR_ESCAPES_FLAT).any(axis=1)
+        winners[escaped] = WHITE_PLAYER
+        ended |= escaped
+
+        if legal_masks is None:
+            legal_masks = self.legal_actions_masks()
+        stuck = ~ended & ~legal_masks.any(axis=1)
+        winners[stuck] = 1 - self.turns[stuck]
+        ended |= stuck
+        return ended, winners
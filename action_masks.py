@@ -0,0 +1,86 @@
+import numpy as np
+
+from utils import *
+import topology
+
+# Squares are flattened in x-major order (x * 9 + y), the order of the (9, 9, 32) action space
+NUM_SQUARES = GRID_COUNT * GRID_COUNT
+MAX_RAY = GRID_COUNT - 1
+OUTSIDE = NUM_SQUARES   # extra square, always blocked, standing for the squares beyond the edge of the board
+
+def _flat_mask(positions):
+    mask = np.zeros(NUM_SQUARES, dtype=bool)
+    for x, y in positions:
+        mask[x * GRID_COUNT + y] = True
+    return mask
+
+CAMPS_FLAT = _flat_mask(CAMPS)
+BLOCKING_FLAT = _flat_mask(CAMPS + [CASTLE])     # squares no piece can enter from outside the camps
+# for every camp, its squares and the squares a black piece standing in it cannot enter: the castle and the other camps
+CAMP_GROUPS_FLAT = np.stack([_flat_mask(group) for group in topology.CAMP_GROUPS])
+BLOCKING_FROM_CAMP_FLAT = np.stack([_flat_mask(list(topology.CAMPS_SET - group) + [CASTLE])
+                                    for group in topology.CAMP_GROUPS])
+
+def _build_ray_matrix():
+    """RAY_MATRIX[q, a] is 1 if square q lies on the path of action a, from the square after the start to the end.
+
+    Multiplying a vector of blocked squares by it counts the obstacles along every action at once.
+    """
+    ray_matrix = np.zeros((NUM_SQUARES + 1, NUM_ACTIONS), dtype=np.float32)
+    for x, y in topology.POSITIONS:
+        for (dx, dy), ray in zip(topology.RAY_DIRS, topology.RAYS[(x, y)]):
+            for k in range(1, MAX_RAY + 1):
+                z = k * (dx + dy)
+                i = (z - 1 if z > 0 else z) + (8 if dx == 0 else 24)
+                a = (x * GRID_COUNT + y) * 32 + i
+                for rx, ry in ray[:k]:
+                    ray_matrix[rx * GRID_COUNT + ry, a] = 1
+                if k > len(ray):
+                    ray_matrix[OUTSIDE, a] = 1
+    return ray_matrix
+
+RAY_MATRIX = _build_ray_matrix()
+
+
+def legal_actions_masks(planes, turns):
+    """Compute the legal actions of a batch of positions with vectorized ray operations
+
+    Args:
+        planes (np.ndarray): (N, 3, 9, 9) occupancy planes for black, white and king indexed by [y, x],
+            i.e. the layout returned by to_onehot_tensor
+        turns (array-like): the N players to move
+
+    Returns:
+        A (N, NUM_ACTIONS) boolean array, True for the legal actions
+    """
+    planes = np.asarray(planes)
+    n = planes.shape[0]
+
+    # swap to x-major squares, as in the action space
+    pieces = planes.transpose(0, 1, 3, 2).reshape(n, 3, NUM_SQUARES) != 0
+    black = pieces[:, 0]
+    white = pieces[:, 1] | pieces[:, 2]
+    occupied = black | white
+    own = np.where(np.asarray(turns).reshape(n, 1) == WHITE_PLAYER, white, black)
+
+    # black pieces standing in a camp can walk inside it but not into the other camps, every other piece is stopped
+    # by all the camps, so the obstacles are counted once per case: on axis 1, index 0 for the pieces outside the
+    # camps and 1 + g for those in camp g
+    campers = own & black & CAMPS_FLAT
+    num_groups = len(CAMP_GROUPS_FLAT)
+    blocked = np.ones((n, 1 + num_groups, NUM_SQUARES + 1), dtype=np.float32)
+    blocked[:, 0, :NUM_SQUARES] = occupied | BLOCKING_FLAT
+    blocked[:, 1:, :NUM_SQUARES] = occupied[:, np.newaxis] | BLOCKING_FROM_CAMP_FLAT
+
+    reachable = (blocked @ RAY_MATRIX == 0).reshape(n, 1 + num_groups, NUM_SQUARES, 32)
+    reachable[:, 0] &= (own & ~campers)[:, :, np.newaxis]
+    reachable[:, 1:] &= (campers[:, np.newaxis] & CAMP_GROUPS_FLAT)[:, :, :, np.newaxis]
+    return reachable.any(axis=1).reshape(n, NUM_ACTIONS)
+
+
+def indices_to_mask(indices):
+    """Boolean mask over the action space of the action indices, the legal actions of a single position are
+    generated directly by the engines and only batches go through legal_actions_masks"""
+    mask = np.zeros(NUM_ACTIONS, dtype=bool)
+    mask[indices] = True
+    return mask
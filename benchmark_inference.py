@@ -0,0 +1,62 @@
+from pathlib import Path
+import time
+import torch
+
+from AlphaZeroNet import AlphaZeroNet
+from inference import export_for_inference
+from utils import *
+
+# Latency and throughput on CPU of the Lightning AlphaZeroNet against the inference engines of inference.py
+
+BATCH_SIZES = [1, 8, 64, 256]
+MIN_TIME = 2    # seconds spent on every measure
+
+def measure(network, batch_size):
+    """Average seconds per forward pass of a random batch"""
+    x = (torch.rand(batch_size, 3, 9, 9) < 0.1).float()
+    network(x)  # warm up
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < MIN_TIME:
+        network(x)
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+def max_error(network, reference):
+    x = (torch.rand(64, 3, 9, 9) < 0.1).float()
+    with torch.no_grad():
+        pi, v = network(x)
+        ref_pi, ref_v = reference(x)
+    return max((pi - ref_pi).abs().max().item(), (v - ref_v).abs().max().item())
+
+
+if __name__ == '__main__':
+    WHITE_AI_PATH = Path('./ckpts/white_model.ckpt')
+    if WHITE_AI_PATH.is_file():
+        model = AlphaZeroNet.load_from_checkpoint(WHITE_AI_PATH)
+        print("Loaded white model")
+    else:
+        model = AlphaZeroNet((3, 9, 9), NUM_ACTIONS)
+    model.eval()
+
+    def lightning(x):
+        with torch.no_grad():
+            return model(x)
+
+    engines = {
+        'lightning': lightning,
+        'fused': export_for_inference(model, torchscript=False),
+        'torchscript': export_for_inference(model),
+        'channels last': export_for_inference(model, channels_last=True),
+        'int8 policy': export_for_inference(model, quantize=True),
+        'all': export_for_inference(model, channels_last=True, quantize=True),
+    }
+
+    print(f"torch intra-op threads: {torch.get_num_threads()}")
+    print(f"{'engine':>14} {'max error':>10}" + ''.join(f"{f'batch {b}':>22}" for b in BATCH_SIZES))
+    for name, network in engines.items():
+        row = f"{name:>14} {max_error(network, lightning):10.1e}"
+        for batch_size in BATCH_SIZES:
+            seconds = measure(network, batch_size)
+            row += f"{seconds * 1e3:9.2f} ms {batch_size / seconds:7.0f}/s"
+        print(row)
@@ -0,0 +1,97 @@
+import random
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+from AI import Node, DummyNode
+from BitBoard import BitBoard
+from utils import *
+
+# Bytes per search tree node of the compact Node against the former dense layout, which allocated three
+# NUM_ACTIONS arrays in every node, and the time of one PUCT evaluation on each
+
+NUM_NODES = 5000
+
+
+class DenseNode:
+    """The former Node layout, kept here as the reference of the benchmark"""
+
+    def __init__(self, board, parent=None, action=None):
+        self.turn = board.turn
+        self.hash = board.hash
+        self.is_terminal, self.winner = board.check_end_game()
+
+        self.is_expanded = False
+        self.parent = parent
+        self.action = action
+
+        self.child_W = np.zeros(NUM_ACTIONS, dtype=np.float32)
+        self.child_N = np.zeros(NUM_ACTIONS, dtype=np.float32)
+        self.pi = np.zeros(NUM_ACTIONS, dtype=np.float32)
+
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def expand(self, pi):
+        self.pi = pi
+        self.is_expanded = True
+
+
+def random_game_positions(n):
+    """Positions from random games, as found in a search tree"""
+    positions = []
+    while len(positions) < n:
+        board = BitBoard()
+        for _ in range(random.randint(0, 60)):
+            if board.check_end_game()[0]:
+                break
+            piece, moves = random.choice(board.actions())
+            board.take_action([piece, random.choice(moves)])
+        if not board.check_end_game()[0]:
+            positions.append(board)
+    return positions
+
+def bytes_per_node(node_class, positions, expanded):
+    """Average memory allocated for a node"""
+    parent = DummyNode()
+    policies = [np.random.dirichlet(np.ones(NUM_ACTIONS)).astype(np.float32) for _ in positions]
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    nodes = []
+    for i, board in enumerate(positions):
+        node = node_class(board, parent=parent, action=None)
+        if expanded:
+            node.expand(policies[i])
+        nodes.append(node)
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    # the priors of the dense layout are the array given by the network, which the node keeps alive
+    if expanded and node_class is DenseNode:
+        size += sum(pi.nbytes for pi in policies)
+    return size / len(nodes)
+
+def puct_time(node, repeat=2000):
+    """Time of the PUCT scores of all the children of node, as computed by AI._best_action"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        puct_scores = - node.child_W / (node.child_N + 1e-5) + node.pi * 10 / (node.child_N + 1)
+        np.argmax(puct_scores)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    np.random.seed(0)
+    positions = random_game_positions(NUM_NODES)
+    print(f"{NUM_NODES} positions, {np.mean([b.legal_actions_array().sum() for b in positions]):.1f} legal moves on average")
+
+    for node_class in [DenseNode, Node]:
+        leaf = bytes_per_node(node_class, positions, expanded=False)
+        expanded = bytes_per_node(node_class, positions, expanded=True)
+
+        node = node_class(positions[0])
+        node.expand(np.ones(NUM_ACTIONS, dtype=np.float32) / NUM_ACTIONS)
+        print(f"{node_class.__name__:>9}: {leaf:8.0f} bytes per leaf, {expanded:8.0f} bytes per expanded node, "
+              f"{puct_time(node) * 1e6:.1f} us per PUCT selection")
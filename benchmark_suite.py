@@ -0,0 +1,107 @@
+import copy
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import torch
+
+from AI import AI
+from AlphaZeroNet import AlphaZeroNet
+from perft import ENGINES, run_perft, sample_corpus_positions
+from utils import *
+
+# Speed of the game engines and of the search, appended as one JSON line per run to RESULTS_PATH (or the path given
+# as argument), so that the speedups and regressions of Board, Piece, Square and BitBoard can be followed over commits.
+# Every time is the median over the sampled positions of the mean over REPEAT calls, in microseconds.
+
+RESULTS_PATH = 'benchmark_results.jsonl'
+NUM_POSITIONS = 50
+REPEAT = 20
+PERFT_DEPTH = 2
+MCTS_SIMULATIONS = 200
+
+
+def time_call(function, repeat=REPEAT):
+    """Mean time of function() in microseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def time_take_action(board):
+    """Mean time of take_action followed by undo_action over the legal moves of board, in microseconds"""
+    moves = [[start, end] for start, ends in board.actions() for end in ends]
+    start = time.perf_counter()
+    for move in moves:
+        board.undo_action(board.take_action(move))
+    return (time.perf_counter() - start) / max(1, len(moves)) * 1e6
+
+def engine_benchmarks(engine, positions):
+    timings = {'actions': [], 'take_undo_action': [], 'check_end_game': [], 'legal_actions_array': [],
+               'to_onehot_tensor': [], 'deepcopy': []}
+    for configuration, turn in positions:
+        board = ENGINES[engine](configuration, turn)
+        timings['actions'].append(time_call(board.actions))
+        timings['take_undo_action'].append(time_take_action(board))
+        timings['check_end_game'].append(time_call(board.check_end_game))
+        timings['legal_actions_array'].append(time_call(board.legal_actions_array))
+        timings['to_onehot_tensor'].append(time_call(board.to_onehot_tensor))
+        timings['deepcopy'].append(time_call(lambda: copy.deepcopy(board)))
+    return {name: float(np.median(values)) for name, values in timings.items()}
+
+def mcts_benchmark(engine, network):
+    """Mean time of one MCTS simulation (selection, network evaluation and backup) from the initial position"""
+    ai = AI(AI_BUDGET, WHITE_PLAYER)
+    ai.alphazero = ai.opponent = network
+    board = ENGINES[engine](INITIAL_CONFIG, 'WHITE')
+    root = ai._prepare_root(board, root_noise=False)
+    ai.search_board = copy.deepcopy(board)
+    start = time.perf_counter()
+    for _ in range(MCTS_SIMULATIONS):
+        ai._simulation(root)
+    return (time.perf_counter() - start) / MCTS_SIMULATIONS * 1e6
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv) > 1 else RESULTS_PATH
+    positions = sample_corpus_positions(NUM_POSITIONS)
+    network = AlphaZeroNet((3, 9, 9), NUM_ACTIONS).eval()   # the speed does not depend on the weights
+
+    result = {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+              'python': platform.python_version(), 'torch': torch.__version__, 'torch_threads': torch.get_num_threads(),
+              'positions': len(positions), 'engines': {}}
+    for engine in ENGINES:
+        perft_result = run_perft(engine, positions, PERFT_DEPTH)
+        result['engines'][engine] = dict(engine_benchmarks(engine, positions),
+                                         perft_depth=PERFT_DEPTH, perft_leaves=perft_result['leaves'],
+                                         perft_leaves_per_second=perft_result['leaves_per_second'],
+                                         mcts_simulation=mcts_benchmark(engine, network))
+
+    # compared with the last run recorded in the same file
+    previous = None
+    if Path(output).is_file():
+        with open(output) as f:
+            lines = f.read().splitlines()
+        previous = json.loads(lines[-1])['engines'] if lines else None
+
+    for engine, timings in result['engines'].items():
+        print(engine)
+        for name, value in timings.items():
+            change = ''
+            if previous is not None and name in previous.get(engine, {}) and previous[engine][name]:
+                change = f"  x{value / previous[engine][name]:.2f} since the last run"
+            print(f"  {name:>24}: {value:12.1f}{change}")
+
+    with open(output, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    print(f"Results appended to {output}")
@@ -0,0 +1,41 @@
+from pathlib import Path
+import time
+import torch
+
+from AI import AI
+from AlphaZeroNet import AlphaZeroNet
+from BitBoard import BitBoard
+from utils import *
+
+# Scaling of the tree-parallel search: simulations per second from the initial position with 1, 2, 4 and 8 threads
+
+SEARCH_TIME = 20    # seconds of search per measure, AI.MCTS keeps 5 of them aside
+THREADS = [1, 2, 4, 8]
+
+if __name__ == '__main__':
+    WHITE_AI_PATH = Path('./ckpts/white_model.ckpt')
+    BLACK_AI_PATH = Path('./ckpts/black_model.ckpt')
+
+    if WHITE_AI_PATH.is_file() and BLACK_AI_PATH.is_file():
+        white_alphazero = AlphaZeroNet.load_from_checkpoint(WHITE_AI_PATH)
+        black_alphazero = AlphaZeroNet.load_from_checkpoint(BLACK_AI_PATH)
+        print("Loaded models")
+    else:
+        # the speed does not depend on the weights, untrained networks of the same size will do
+        white_alphazero = AlphaZeroNet((3, 9, 9), NUM_ACTIONS)
+        black_alphazero = AlphaZeroNet((3, 9, 9), NUM_ACTIONS)
+    white_alphazero.eval()
+    black_alphazero.eval()
+
+    print(f"torch intra-op threads: {torch.get_num_threads()}")
+    baseline = None
+    for num_threads in THREADS:
+        ai = AI(AI_BUDGET, WHITE_PLAYER, batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, num_threads=num_threads)
+        ai.alphazero = white_alphazero
+        ai.opponent = black_alphazero
+
+        start = time.perf_counter()
+        ai.MCTS(BitBoard(), timeout=SEARCH_TIME, root_noise=False)
+        speed = ai.simulations / (time.perf_counter() - start)
+        baseline = baseline or speed
+        print(f"{num_threads} threads: {ai.simulations} simulations, {speed:.1f} simulations/s, x{speed / baseline:.2f}")
@@ -62,6 +62,39 @@ def data_action_to_action_dist(action, literal_form=True):
     tensor = tensor.ravel()     # flatten tensor
     return tensor
 
+def index_to_action(index):
+    """Convert an index of the flattened (9, 9, 32) action space to a (pos_start, pos_end) action."""
+    z = index % 32
+    index //= 32
+    y = index % 9
+    index //= 9
+    x = index
+
+    if z >= 16:
+        z -= 16 + 8
+        z += 1 if z >= 0 else 0
+        pos_start = (x, y)
+        pos_end = (x + z, y)
+    else:
+        z -= 8
+        z += 1 if z >= 0 else 0
+        pos_start = (x, y)
+        pos_end = (x, y + z)
+    return pos_start, pos_end
+
+def action_to_index(pos_start, pos_end):
+    """Convert a (pos_start, pos_end) action to its index in the flattened (9, 9, 32) action space, the inverse of
+    index_to_action. pos_end may lie outside the board, only the distance from pos_start is encoded."""
+    dx = pos_end[0] - pos_start[0]
+    dy = pos_end[1] - pos_start[1]
+    if dx == 0:
+        i = dy - 1 if dy > 0 else dy
+        i += 8
+    else:
+        i = dx - 1 if dx > 0 else dx
+        i += 8 + 16
+    return (pos_start[0] * 9 + pos_start[1]) * 32 + i
+
 def action_dist_to_action(action_dist):
     """Convert an action distribution to an action."""
     # TODO: double check! Copilot generated and see if it is really needed or not
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import re
+import sys
+from pathlib import Path
+from typing import NamedTuple
+import numpy as np
+
+
+from conversions import action_to_index, literal_to_pos_action
+from replay_buffer import pack_states, PACKED_STATE_BYTES
+from utils import *
+
+# The server game logs in data/ converted once into a compact binary corpus, so that training starts without parsing
+# text. Every log is parsed into its own small .npz file in games/, named after the hash of the log, and listed in
+# manifest.json with its mtime and hash: only new or changed logs are parsed again, in a process pool. The positions
+# of all the games are then concatenated into a few .npy files, loaded (or memory-mapped) by load_corpus.
+
+CORPUS_DIR = Path('corpus')
+CORPUS_ARRAYS = ('boards', 'actions', 'values', 'turns', 'game_offsets')
+
+STATE_REGEX = re.compile(r'FINE: Stato:(.*?)-', flags=re.DOTALL)
+ACTION_REGEX = re.compile(r'FINE: Turn: .* Pawn from (..) to (..)')
+PIECE_PLANES = {ord('B'): 0, ord('W'): 1, ord('K'): 2}
+
+
+class Corpus(NamedTuple):
+    boards: np.ndarray          # (N, PACKED_STATE_BYTES) bit-packed (3, 9, 9) planes
+    actions: np.ndarray         # (N,) int16 index of the move played
+    values: np.ndarray          # (N,) int8 result of the game for the player to move
+    turns: np.ndarray           # (N,) int8 player to move
+    game_offsets: np.ndarray    # (G + 1,) first position of every game, and N
+
+
+def log_boards(states):
+    """Convert the 'Stato' strings of a log to (N, 3, 9, 9) planes, as data_board_to_one_hot_board does"""
+    planes = np.zeros((len(states), 3, GRID_COUNT * GRID_COUNT), dtype=bool)
+    for i, state in enumerate(states):
+        squares = np.frombuffer(state.replace('\n', '').encode(), dtype=np.uint8)[:GRID_COUNT * GRID_COUNT]
+        for char, plane in PIECE_PLANES.items():
+            planes[i, plane, :len(squares)] = squares == char
+    return planes.reshape(len(states), 3, GRID_COUNT, GRID_COUNT)
+
+def parse_log(path):
+    """Parse a game log, with the same rules as data_handler.file_to_game_sequence
+
+    Returns:
+        'ok' and the arrays of the game, or 'draw' / 'invalid' and None
+    """
+    with open(path, 'r') as file:
+        contents = file.read()
+
+    states = STATE_REGEX.findall(contents)[:-2]
+    actions = ACTION_REGEX.findall(contents)
+    winner = contents[-3:-1]
+    if winner != 'WW' and winner != 'BW' or len(states) == 0:
+        return 'draw', None     # counted with the draws, as file_to_game_sequence returns no transitions either
+    if len(states) != len(actions):
+        return 'invalid', None
+
+    action_indices = []
+    for literal_start, literal_end in actions:
+        start, end = literal_to_pos_action(literal_start), literal_to_pos_action(literal_end)
+        if start[0] != end[0] and start[1] != end[1]:
+            return 'invalid', None     # not a straight move
+        action_indices.append(action_to_index(start, end))
+
+    turns = np.arange(len(states)) % 2     # the logs start with white, WHITE_PLAYER = 0
+    winner = WHITE_PLAYER if winner == 'WW' else BLACK_PLAYER
+    return 'ok', {'boards': pack_states(log_boards(states)),
+                  'actions': np.array(action_indices, dtype=np.int16),
+                  'values': np.where(turns == winner, 1, -1).astype(np.int8),
+                  'turns': turns.astype(np.int8)}
+
+def _parse_to_file(job):
+    path, digest, games_dir = job
+    try:
+        status, game = parse_log(path)
+    except Exception:
+        return 'invalid', 0     # unreadable or malformed log
+    if status == 'ok':
+        np.savez(games_dir / f'{digest}.npz', **game)
+        return status, len(game['actions'])
+    return status, 0
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def update_corpus(log_dir='data', corpus_dir=CORPUS_DIR, num_processes=None):
+    """Bring the corpus up to date with the logs in log_dir, parsing only the new or changed ones
+
+    Args:
+        log_dir (str): folder of the server game logs
+        corpus_dir (str): folder of the corpus
+        num_processes (int): processes parsing the logs, the number of CPUs if not given
+
+    Returns:
+        A dict of counters: logs parsed and reused, positions, draws and invalid logs
+    """
+    log_dir, corpus_dir = Path(log_dir), Path(corpus_dir)
+    games_dir = corpus_dir / 'games'
+    games_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = corpus_dir / 'manifest.json'
+    old_manifest = {}
+    if manifest_path.is_file():
+        with open(manifest_path) as f:
+            old_manifest = json.load(f)
+
+    manifest = {}
+    jobs = []
+    for name in sorted(os.listdir(log_dir)):
+        path = log_dir / name
+        mtime = path.stat().st_mtime
+        entry = old_manifest.get(name)
+        if entry is not None and entry['mtime'] == mtime:
+            manifest[name] = entry
+            continue
+        # a touched file whose contents did not change is not parsed again either
+        digest = file_digest(path)
+        if entry is not None and entry['sha1'] == digest:
+            manifest[name] = dict(entry, mtime=mtime)
+            continue
+        manifest[name] = {'mtime': mtime, 'sha1': digest}
+        jobs.append((path, digest, games_dir))
+
+    if jobs:
+        with mp.Pool(num_processes) as pool:
+            results = pool.map(_parse_to_file, jobs, chunksize=8)
+        for (path, _, _), (status, positions) in zip(jobs, results):
+            manifest[path.name].update(status=status, positions=positions)
+
+    # the games of deleted or changed logs
+    kept = {entry['sha1'] for entry in manifest.values() if entry['status'] == 'ok'}
+    for game_file in games_dir.glob('*.npz'):
+        if game_file.stem not in kept:
+            game_file.unlink()
+
+    if jobs or manifest.keys() != old_manifest.keys() or not (corpus_dir / 'boards.npy').is_file():
+        _concatenate(manifest, corpus_dir)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    statuses = [entry['status'] for entry in manifest.values()]
+    return {'parsed': len(jobs), 'reused': len(manifest) - len(jobs),
+            'positions': sum(entry['positions'] for entry in manifest.values()),
+            'draws': statuses.count('draw'), 'invalids': statuses.count('invalid')}
+
+def _concatenate(manifest, corpus_dir):
+    """Write the arrays of all the games, in the order of the log names, as the .npy files of the corpus"""
+    games = []
+    for name in sorted(manifest):
+        if manifest[name]['status'] == 'ok':
+            with np.load(corpus_dir / 'games' / f"{manifest[name]['sha1']}.npz") as game:
+                games.append({key: game[key] for key in game.files})
+
+    lengths = [len(game['actions']) for game in games]
+    arrays = {'game_offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)}
+    for key, empty in (('boards', np.zeros((0, PACKED_STATE_BYTES), dtype=np.uint8)),
+                       ('actions', np.zeros(0, dtype=np.int16)),
+                       ('values', np.zeros(0, dtype=np.int8)), ('turns', np.zeros(0, dtype=np.int8))):
+        arrays[key] = np.concatenate([game[key] for game in games]) if games else empty
+    for key in CORPUS_ARRAYS:
+        np.save(corpus_dir / f'{key}.npy', arrays[key])
+
+def load_corpus(corpus_dir=CORPUS_DIR, mmap=True):
+    """Load the corpus written by update_corpus, memory-mapped by default"""
+    return Corpus(**{key: np.load(Path(corpus_dir) / f'{key}.npy', mmap_mode='r' if mmap else None)
+                     for key in CORPUS_ARRAYS})
+
+
+if __name__ == '__main__':
+    # python corpus.py [log dir] [corpus dir]
+    log_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    corpus_dir = sys.argv[2] if len(sys.argv) > 2 else CORPUS_DIR
+    stats = update_corpus(log_dir, corpus_dir)
+    print(f"Corpus {corpus_dir}: {stats['parsed']} logs parsed, {stats['reused']} unchanged, "
+          f"{stats['positions']} positions, {stats['draws']} draws, {stats['invalids']} invalid logs")
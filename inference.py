@@ -0,0 +1,109 @@
+from abc import ABC, abstractmethod
+import copy
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+# Inference only version of AlphaZeroNet for the search: BatchNorm folded into the convolutions, no autograd,
+# optionally traced to TorchScript, in channels last layout and with the policy linear layer quantized to int8.
+
+
+def _fuse(conv, bn):
+    return fuse_conv_bn_eval(copy.deepcopy(conv).eval(), copy.deepcopy(bn).eval())
+
+
+class FusedResNetBlock(nn.Module):
+    def __init__(self, block):
+        super().__init__()
+        self.conv1 = _fuse(block.conv_block1[0], block.conv_block1[1])
+        self.conv2 = _fuse(block.conv_block2[0], block.conv_block2[1])
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = nn.functional.relu(self.conv1(x))
+        out = self.conv2(out)
+        return nn.functional.relu(out + x)
+
+
+class InferenceNet(nn.Module):
+    """Same outputs as the AlphaZeroNet it is built from, with every Conv2d + BatchNorm2d pair folded into one Conv2d"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.conv = _fuse(model.conv_block[0], model.conv_block[1])
+        self.res_blocks = nn.Sequential(*[FusedResNetBlock(block) for block in model.res_blocks])
+
+        self.policy_conv = _fuse(model.policy_head[0], model.policy_head[1])
+        self.policy_fc = copy.deepcopy(model.policy_head[4])
+
+        self.value_conv = _fuse(model.value_head[0], model.value_head[1])
+        self.value_fc1 = copy.deepcopy(model.value_head[4])
+        self.value_fc2 = copy.deepcopy(model.value_head[6])
+
+    def forward(self, x: torch.Tensor):
+        features = self.res_blocks(nn.functional.relu(self.conv(x)))
+
+        pi = nn.functional.relu(self.policy_conv(features)).flatten(1)
+        pi = nn.functional.softmax(self.policy_fc(pi), dim=1)
+
+        value = nn.functional.relu(self.value_conv(features)).flatten(1)
+        value = torch.tanh(self.value_fc2(nn.functional.relu(self.value_fc1(value))))
+        return pi, value
+
+
+class SearchNetwork(ABC):
+    """Base of the callables taking the place of an AlphaZeroNet in AI.alphazero and AI.opponent
+
+    Subclasses map a (B, 3, 9, 9) tensor of planes to the (pi, value) tensors the network would return.
+    """
+
+    @abstractmethod
+    def __call__(self, x):
+        pass
+
+    def eval(self):
+        # always in inference mode, for code written for the Lightning module
+        return self
+
+
+class InferenceEngine(SearchNetwork):
+    """The optimized network, run under torch.inference_mode"""
+
+    def __init__(self, net, channels_last=False):
+        self.net = net
+        self.channels_last = channels_last
+
+    def __call__(self, x):
+        with torch.inference_mode():
+            if self.channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
+            return self.net(x)
+
+
+def export_for_inference(model, torchscript=True, channels_last=False, quantize=False):
+    """Build the CPU inference engine of a trained AlphaZeroNet
+
+    Args:
+        model (AlphaZeroNet): the network, left untouched
+        torchscript (bool): trace and freeze the network with TorchScript, which removes the Python dispatch
+        channels_last (bool): use the channels last memory layout for the convolutions
+        quantize (bool): quantize the weights of the policy linear layer, by far the largest one, to int8
+
+    Returns:
+        An InferenceEngine with the same inputs and outputs as model
+    """
+    net = InferenceNet(model).cpu().eval()
+    if quantize:
+        net = torch.ao.quantization.quantize_dynamic(net, {'policy_fc': torch.ao.quantization.default_dynamic_qconfig},
+                                                     dtype=torch.qint8)
+    if channels_last:
+        net = net.to(memory_format=torch.channels_last)
+
+    if torchscript:
+        c, h, w = model.hparams.input_shape
+        example = torch.zeros(1, c, h, w)
+        if channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad():
+            net = torch.jit.freeze(torch.jit.trace(net, example))
+
+    return InferenceEngine(net, channels_last)
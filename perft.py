@@ -0,0 +1,121 @@
+import json
+import random
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+from Board import Board
+from BitBoard import BitBoard
+from VecBoard import VecBoard
+from corpus import CORPUS_DIR, load_corpus
+from replay_buffer import unpack_states
+from utils import *
+
+# Perft: count the leaf positions of the game tree to a fixed depth with actions, take_action, undo_action and
+# check_end_game. The counts must not change when the engines are optimized (and Board, BitBoard and VecBoard must
+# agree), the positions per second measure their speed. VecBoard, which has no undo, expands the tree a level at a time.
+
+ENGINES = {'Board': lambda configuration, turn: Board(WINDOW_SIZE[0], WINDOW_SIZE[1], configuration, turn),
+           'BitBoard': lambda configuration, turn: BitBoard(configuration, turn)}
+PERFT_ENGINES = [*ENGINES, 'VecBoard']
+
+
+def perft(board, depth):
+    """Number of positions reached in exactly depth moves, the games that end earlier count as one leaf"""
+    if depth == 0 or board.check_end_game()[0]:
+        return 1
+    leaves = 0
+    for pos_start, ends in board.actions():
+        for pos_end in ends:
+            record = board.take_action([pos_start, pos_end])
+            leaves += perft(board, depth - 1)
+            board.undo_action(record)
+    return leaves
+
+def vec_perft(positions, depth):
+    """perft of every (configuration, turn) position at once, breadth first with a VecBoard
+
+    Returns:
+        The list of the leaf counts of the positions
+    """
+    board = VecBoard(len(positions), [c for c, _ in positions], [t for _, t in positions])
+    owners = np.arange(len(positions))     # the position every game of the batch descends from
+    counts = np.zeros(len(positions), dtype=np.int64)
+    for _ in range(depth):
+        masks = board.legal_actions_masks()
+        ended, _ = board.check_end_games(masks)
+        np.add.at(counts, owners[ended], 1)
+        games, actions = np.nonzero(masks & ~ended[:, np.newaxis])
+        board = board.select_games(games)
+        board.take_actions(actions)
+        owners = owners[games]
+    np.add.at(counts, owners, 1)
+    return counts.tolist()
+
+def planes_to_configuration(planes):
+    """The configuration, in the format of INITIAL_CONFIG, of (3, 9, 9) planes indexed by [y, x]"""
+    configuration = [['EMPTY'] * GRID_COUNT for _ in range(GRID_COUNT)]
+    for kind, name in enumerate(['BLACK', 'WHITE', 'KING']):
+        for y, x in zip(*np.nonzero(planes[kind])):
+            configuration[y][x] = name
+    return configuration
+
+def sample_corpus_positions(n, seed=0, corpus_dir=CORPUS_DIR):
+    """n (configuration, turn) pairs drawn from the positions of the game logs, read from an existing corpus
+
+    The corpus is not built here: run python corpus.py (or train_data.py) first.
+    """
+    if not (Path(corpus_dir) / 'boards.npy').is_file():
+        raise FileNotFoundError(f"No corpus in {corpus_dir}, build it with python corpus.py")
+    corpus = load_corpus(corpus_dir)
+    rows = random.Random(seed).sample(range(len(corpus.actions)), min(n, len(corpus.actions)))
+    planes = unpack_states(np.asarray(corpus.boards[rows]))
+    return [(planes_to_configuration(p), 'WHITE' if corpus.turns[r] == WHITE_PLAYER else 'BLACK')
+            for p, r in zip(planes, rows)]
+
+def run_perft(engine, positions, depth):
+    """Perft of every (configuration, turn) position with the given engine
+
+    Returns:
+        A dict with the total leaf count, the counts of every position, the seconds taken and the leaves per second
+    """
+    start = time.perf_counter()
+    if engine == 'VecBoard':
+        counts = vec_perft(positions, depth)
+    else:
+        counts = [perft(ENGINES[engine](configuration, turn), depth) for configuration, turn in positions]
+    seconds = time.perf_counter() - start
+    return {'engine': engine, 'depth': depth, 'positions': len(positions), 'leaves': sum(counts), 'counts': counts,
+            'seconds': seconds, 'leaves_per_second': sum(counts) / seconds}
+
+
+if __name__ == '__main__':
+    # python perft.py [depth] [sampled positions] [output.json] [corpus dir]
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    num_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    output = sys.argv[3] if len(sys.argv) > 3 else None
+    corpus_dir = sys.argv[4] if len(sys.argv) > 4 else CORPUS_DIR
+
+    suites = {'initial': [(INITIAL_CONFIG, 'WHITE')]}
+    try:
+        suites['data'] = sample_corpus_positions(num_samples, corpus_dir=corpus_dir)
+    except FileNotFoundError as e:
+        print(f"{e}, only the initial position is checked")
+    results = []
+    for suite, positions in suites.items():
+        suite_results = [dict(run_perft(engine, positions, depth), suite=suite) for engine in PERFT_ENGINES]
+        for result in suite_results:
+            print(f"{suite:>8} {result['engine']:>8} depth {depth}: {result['leaves']:>10} leaves, "
+                  f"{result['leaves_per_second']:>10.0f} leaves/s")
+        results.extend(suite_results)
+
+        board_counts = suite_results[0]['counts']
+        for result in suite_results[1:]:
+            if result['counts'] != board_counts:
+                mismatches = [i for i, (a, b) in enumerate(zip(board_counts, result['counts'])) if a != b]
+                print(f"MISMATCH between Board and {result['engine']} on {suite} positions {mismatches}")
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,216 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+from symmetries import ACTION_PERMUTATIONS, transform_planes_batch, random_symmetries
+from utils import *
+
+# Persistent replay buffer of self-play positions: fixed-size shards of memory-mapped arrays on disk, so that training
+# samples from many games while the memory used stays flat as the number of games grows.
+#
+# Position number t (counted since the creation of the buffer) lives in row t % shard_size of shard t // shard_size.
+# Every shard is four .npy files: the bit-packed (3, 9, 9) planes, the search policies as policy_entries sparse
+# (action index, float16 probability) pairs and the values.
+
+PACKED_STATE_BYTES = (3 * GRID_COUNT * GRID_COUNT + 7) // 8
+
+def pack_states(planes):
+    """Bit-pack a (N, 3, 9, 9) batch of one-hot planes into (N, PACKED_STATE_BYTES) bytes"""
+    return np.packbits(np.asarray(planes, dtype=bool).reshape(len(planes), 3 * GRID_COUNT * GRID_COUNT), axis=1)
+
+def unpack_states(packed):
+    """Inverse of pack_states, as float32 planes"""
+    bits = np.unpackbits(packed, axis=1, count=3 * GRID_COUNT * GRID_COUNT)
+    return bits.reshape(len(packed), 3, GRID_COUNT, GRID_COUNT).astype(np.float32)
+
+def sparse_policies(pis, max_entries):
+    """Convert dense (N, NUM_ACTIONS) search policies, e.g. normalized visit counts, to sparse (index, probability)
+    pairs, keeping the max_entries most likely actions of each, renormalized. The unused pairs have index -1."""
+    pis = np.asarray(pis, dtype=np.float32)
+    indices = np.argsort(-pis, axis=1, kind='stable')[:, :max_entries]
+    probs = np.take_along_axis(pis, indices, axis=1)
+    probs /= np.maximum(probs.sum(axis=1, keepdims=True), np.finfo(np.float32).tiny)
+    indices[probs == 0] = -1
+    return indices.astype(np.int16), probs.astype(np.float16)
+
+def dense_policies(indices, probs, symmetries=None):
+    """Inverse of sparse_policies, as float32 policies, seen under the given symmetries of symmetries.py if any"""
+    indices = np.asarray(indices, dtype=np.int64)
+    pis = np.zeros((len(indices), NUM_ACTIONS), dtype=np.float32)
+    b, k = np.nonzero(indices >= 0)
+    actions = indices[b, k] if symmetries is None else ACTION_PERMUTATIONS[symmetries[b], indices[b, k]]
+    pis[b, actions] = np.asarray(probs)[b, k]
+    return pis
+
+
+class ReplayBuffer:
+    """Window of the last capacity positions added, stored in shards of shard_size positions under directory
+
+    There must be one writer only, readers (ReplayDataset) see the positions present when they are created.
+    """
+
+    def __init__(self, directory, capacity=REPLAY_WINDOW, shard_size=REPLAY_SHARD_SIZE,
+                 policy_entries=REPLAY_POLICY_ENTRIES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+
+        meta_path = self.directory / 'meta.json'
+        if meta_path.is_file():
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if 'policy_entries' not in meta:
+                raise ValueError(f"{directory} holds dense policies written by an older version, delete it")
+            # the layout on disk wins over the arguments
+            self.shard_size = meta['shard_size']
+            self.policy_entries = meta['policy_entries']
+            self.total = meta['total']
+            self.first = meta['first']
+        else:
+            self.shard_size = shard_size
+            self.policy_entries = policy_entries
+            self.total = 0      # positions ever added
+            self.first = 0      # oldest position still on disk, older shards were deleted
+
+    def __len__(self):
+        return min(self.total - self.first, self.capacity)
+
+    @property
+    def start(self):
+        """Number of the oldest position in the window"""
+        return self.total - len(self)
+
+    def shard_paths(self, shard):
+        return {name: self.directory / f'shard_{shard:06d}.{name}.npy'
+                for name in ('states', 'policy_indices', 'policy_probs', 'values')}
+
+    def _open_shard(self, shard):
+        paths = self.shard_paths(shard)
+        if paths['states'].is_file():
+            return {name: np.load(path, mmap_mode='r+') for name, path in paths.items()}
+        shapes = {'states': ((self.shard_size, PACKED_STATE_BYTES), np.uint8),
+                  'policy_indices': ((self.shard_size, self.policy_entries), np.int16),
+                  'policy_probs': ((self.shard_size, self.policy_entries), np.float16),
+                  'values': ((self.shard_size,), np.float32)}
+        return {name: np.lib.format.open_memmap(paths[name], mode='w+', dtype=dtype, shape=shape)
+                for name, (shape, dtype) in shapes.items()}
+
+    def add(self, transitions):
+        """Append a list of Transitions, such as the ones of a game, dropping the positions that leave the window"""
+        if len(transitions) == 0:
+            return
+        states = pack_states(np.stack([np.asarray(t.state) for t in transitions]))
+        policy_indices, policy_probs = sparse_policies(np.stack([np.asarray(t.pi_prob) for t in transitions]),
+                                                       self.policy_entries)
+        values = np.array([t.value for t in transitions], dtype=np.float32)
+
+        done = 0
+        while done < len(transitions):
+            shard, row = divmod(self.total, self.shard_size)
+            n = min(len(transitions) - done, self.shard_size - row)
+            arrays = self._open_shard(shard)
+            arrays['states'][row:row + n] = states[done:done + n]
+            arrays['policy_indices'][row:row + n] = policy_indices[done:done + n]
+            arrays['policy_probs'][row:row + n] = policy_probs[done:done + n]
+            arrays['values'][row:row + n] = values[done:done + n]
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            self.total += n
+            done += n
+
+        self._drop_old_shards()
+        self._save_meta()
+
+    def _save_meta(self):
+        # written to a temporary file first, a crash never leaves a truncated meta.json
+        tmp_path = self.directory / 'meta.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'shard_size': self.shard_size, 'policy_entries': self.policy_entries, 'total': self.total,
+                       'first': self.first}, f)
+        os.replace(tmp_path, self.directory / 'meta.json')
+
+    def _drop_old_shards(self):
+        first_shard = self.start // self.shard_size
+        for shard in range(self.first // self.shard_size, first_shard):
+            for path in self.shard_paths(shard).values():
+                path.unlink(missing_ok=True)
+        self.first = max(self.first, first_shard * self.shard_size)
+
+
+class ReplayDataset(Dataset):
+    """Dataset of the positions in the window of a ReplayBuffer when the dataset is created
+
+    The shards are memory-mapped lazily, in every DataLoader worker, so only the rows read are loaded into RAM.
+    An item is the compact row of a position, collate expands a whole batch to the planes and the dense policies.
+    With data_augmentation, collate shows every position of a batch under a random symmetry of the board.
+    """
+
+    def __init__(self, buffer, data_augmentation=True):
+        super().__init__()
+        self.data_augmentation = data_augmentation
+        self.directory = buffer.directory
+        self.shard_size = buffer.shard_size
+        self.start = buffer.start
+        self.length = len(buffer)
+        self.shard_paths = buffer.shard_paths
+        self._shards = {}
+
+    def __len__(self):
+        return self.length
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = {name: np.load(path, mmap_mode='r') for name, path in self.shard_paths(shard).items()}
+        return self._shards[shard]
+
+    def __getitem__(self, idx):
+        shard, row = divmod(self.start + idx, self.shard_size)
+        arrays = self._shard(shard)
+        return tuple(np.array(arrays[name][row]) for name in ('states', 'policy_indices', 'policy_probs', 'values'))
+
+    def collate(self, batch):
+        """Build the (states, pis, values) tensors of a batch of rows, the collate_fn of the DataLoader"""
+        states, policy_indices, policy_probs, values = (np.stack(column) for column in zip(*batch))
+        states = unpack_states(states)
+        symmetries = None
+        if self.data_augmentation:
+            symmetries = random_symmetries(len(batch))
+            states = transform_planes_batch(states, symmetries)
+        pis = dense_policies(policy_indices, policy_probs, symmetries)
+        return torch.from_numpy(states), torch.from_numpy(pis), torch.from_numpy(values.astype(np.float32))
+
+    def __getstate__(self):
+        # the memory maps are not sent to the DataLoader workers, each one opens its own
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+class ReplaySampler(Sampler):
+    """Draw num_samples positions of a ReplayDataset with replacement, uniformly or favouring the recent ones
+
+    Args:
+        half_life (int): with recency weighting, a position is half as likely to be drawn as one half_life positions
+            newer than it. None samples uniformly.
+    """
+
+    def __init__(self, dataset, num_samples, half_life=None):
+        self.dataset = dataset
+        self.num_samples = num_samples
+        self.half_life = half_life
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        n = len(self.dataset)
+        if self.half_life is None:
+            indices = torch.randint(n, (self.num_samples,))
+        else:
+            ages = torch.arange(n - 1, -1, -1, dtype=torch.float64)     # 0 for the newest position
+            indices = torch.multinomial(torch.exp2(-ages / self.half_life), self.num_samples, replacement=True)
+        return iter(indices.tolist())
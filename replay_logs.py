@@ -0,0 +1,149 @@
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from conversions import action_to_index, literal_to_pos_action
+from perft import ENGINES, planes_to_configuration
+from VecBoard import VecBoard
+from utils import *
+
+# Rule validator: replay every move of the server game logs in data/ with one of our engines and compare the position
+# after each move with the state logged by the server, the reference implementation of the rules. Any engine must
+# pass this before it is trusted in the search.
+#
+#   python replay_logs.py [Board|BitBoard|VecBoard] [num_processes]
+
+STATE_REGEX = re.compile(r'FINE: Stato:\n(.*?)-\n(\w+)', flags=re.DOTALL)     # board and turn (or result)
+MOVE_REGEX = re.compile(r'FINE: Turn: .* Pawn from (..) to (..)')
+LOG_PIECES = {'O': 'EMPTY', 'T': 'EMPTY', 'B': 'BLACK', 'W': 'WHITE', 'K': 'KING'}
+RESULTS = {'WW': WHITE_PLAYER, 'BW': BLACK_PLAYER}
+
+
+class VecGame:
+    """A VecBoard of one game behind the single board methods used by replay_log"""
+
+    def __init__(self, configuration, turn):
+        self.board = VecBoard(1, [configuration], [turn])
+
+    def legal_actions_array(self):
+        return self.board.legal_actions_masks()[0]
+
+    def take_action(self, action):
+        self.board.take_actions([action_to_index(*action)])
+
+    def to_planes(self):
+        return self.board.to_planes()[0]
+
+    def check_end_game(self):
+        ended, winners = self.board.check_end_games()
+        return bool(ended[0]), int(winners[0]) if ended[0] else None
+
+    def king_captured(self):
+        return bool(self.board.king_captured[0])
+
+REPLAY_ENGINES = dict(ENGINES, VecBoard=VecGame)
+
+
+def parse_state(board_string):
+    return [[LOG_PIECES[c] for c in row] for row in board_string.strip().split('\n')[:GRID_COUNT]]
+
+def mismatch_category(squares):
+    """Name the rule a set of wrong squares most likely comes from"""
+    if any(pos == CASTLE or pos in ADJ_CASTLE for pos in squares):
+        return 'castle'
+    if any(pos in CAMPS for pos in squares):
+        return 'camp'
+    return 'capture'
+
+def replay_log(job):
+    """Replay one log with an engine
+
+    Returns:
+        A dict with the name of the log, the moves replayed, the illegal moves rejected by the server and the list
+        of mismatches, each one a (move number, category, description) tuple
+    """
+    path, engine = job
+    with open(path, 'r') as file:
+        contents = file.read()
+    states = [(parse_state(board), turn) for board, turn in STATE_REGEX.findall(contents)]
+    moves = MOVE_REGEX.findall(contents)
+    report = {'log': Path(path).name, 'moves': 0, 'illegal': 0, 'mismatches': []}
+    if len(states) == 0:
+        return report
+
+    board = REPLAY_ENGINES[engine](states[0][0], 'WHITE' if states[0][1] == 'W' else 'BLACK')
+    for k, (literal_start, literal_end) in enumerate(moves):
+        if k + 1 >= len(states):
+            break
+        (before, _), (after, turn) = states[k], states[k + 1]
+        pos_start, pos_end = literal_to_pos_action(literal_start), literal_to_pos_action(literal_end)
+        straight = pos_start[0] == pos_end[0] or pos_start[1] == pos_end[1]
+        legal = straight and bool(board.legal_actions_array()[action_to_index(pos_start, pos_end)])
+
+        if after == before:
+            # the server rejected the move and logged the same state again: the game is lost by the mover
+            report['illegal'] += 1
+            if legal:
+                report['mismatches'].append((k, 'legality', f"{literal_start}-{literal_end} rejected by the server"))
+            break
+        if not legal:
+            report['mismatches'].append((k, 'legality', f"{literal_start}-{literal_end} accepted by the server"))
+            break
+
+        board.take_action([pos_start, pos_end])
+        report['moves'] += 1
+        ours = planes_to_configuration(board.to_planes())
+        end, winner = board.check_end_game()
+
+        wrong = [(x, y) for y in range(GRID_COUNT) for x in range(GRID_COUNT) if ours[y][x] != after[y][x]]
+        if end and winner == BLACK_PLAYER and board.king_captured():
+            # the server leaves the captured king on the board in the last state
+            wrong = [(x, y) for x, y in wrong if not (after[y][x] == 'KING' and ours[y][x] == 'EMPTY')]
+        if wrong:
+            squares = ' '.join(f"{chr(ord('a') + x)}{y + 1}:{after[y][x][0]}/{ours[y][x][0]}" for x, y in wrong)
+            report['mismatches'].append((k, mismatch_category(wrong), f"after {literal_start}-{literal_end}, "
+                                                                       f"logged/ours {squares}"))
+            break
+
+        if turn in RESULTS and (not end or winner != RESULTS[turn]):
+            report['mismatches'].append((k, 'end of game', f"server result {turn}, ours {end, winner}"))
+            break
+        if turn in ('W', 'B') and end:
+            report['mismatches'].append((k, 'end of game', f"the game goes on, ours is over with winner {winner}"))
+            break
+        if turn in RESULTS or turn not in ('W', 'B'):
+            break   # over, a draw included
+    return report
+
+
+def replay_logs(log_dir='data', engine='Board', num_processes=None):
+    """Replay all the logs of log_dir in a process pool
+
+    Returns:
+        The reports of replay_log and the seconds taken
+    """
+    jobs = [(os.path.join(log_dir, name), engine) for name in sorted(os.listdir(log_dir))]
+    start = time.perf_counter()
+    with mp.Pool(num_processes) as pool:
+        reports = pool.map(replay_log, jobs, chunksize=4)
+    return reports, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    engine = sys.argv[1] if len(sys.argv) > 1 else 'Board'
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    reports, seconds = replay_logs('data', engine, num_processes)
+    moves = sum(report['moves'] for report in reports)
+    mismatches = [(report['log'], *mismatch) for report in reports for mismatch in report['mismatches']]
+
+    print(f"{engine}: {len(reports)} logs, {moves} moves replayed in {seconds:.1f}s ({moves / seconds:.0f} moves/s), "
+          f"{sum(report['illegal'] for report in reports)} illegal moves rejected by the server")
+    for log, k, category, description in mismatches:
+        print(f"  {log} move {k}: {category}: {description}")
+    print(f"Mismatches: {len(mismatches)} {dict(Counter(m[2] for m in mismatches))}")
+    sys.exit(1 if mismatches else 0)
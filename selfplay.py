@@ -0,0 +1,245 @@
+import multiprocessing as mp
+import queue
+import time
+import numpy as np
+import torch
+
+from AI import AI, lockstep_MCTS
+from AlphaZeroNet import AlphaZeroNet
+from BitBoard import BitBoard
+from data_handler import Transition
+from EvaluationCache import EvaluationCache
+from inference import SearchNetwork
+from utils import *
+
+# Parallel self-play: worker processes play the games, each with its own two AIs, while a single inference server
+# process owns the white and black networks. The workers send the leaves of their searches to the server, which
+# gathers the requests of all the workers into large batches, runs one forward pass per network and sends the
+# results back. Games per hour scale with the number of workers, and the network runs on big batches.
+
+NETWORKS = ('white', 'black')
+
+
+def play_game(ai_white, ai_black, timeout=60, on_move=None):
+    """Play a self-play game between two AIs
+
+    Args:
+        ai_white (AI): the AI playing white
+        ai_black (AI): the AI playing black
+        timeout (float): seconds of search for every move
+        on_move (callable): called with the board after every move, e.g. to draw it
+
+    Returns:
+        The list of Transitions of the game, with the value from the point of view of the player to move, and the winner
+    """
+    board = BitBoard()
+    game_states = []
+    game_pis = []
+    to_plays = []
+
+    while True:
+        ai = ai_white if board.turn == WHITE_PLAYER else ai_black
+        action, pred_win_rate, root_pi = ai.MCTS(board, timeout=timeout)
+
+        game_states.append(board.to_planes())
+        game_pis.append(root_pi.astype(np.float32))
+        to_plays.append(board.turn)
+
+        board.take_action(action)
+        if on_move is not None:
+            on_move(board)
+
+        end, winner = board.check_end_game()
+        if end:
+            break
+
+    game_values = np.array([1 if play_id == winner else -1 for play_id in to_plays], dtype=np.float32)
+    game_seq = [Transition(state=x, pi_prob=pi, value=v) for x, pi, v in zip(game_states, game_pis, game_values)]
+    return game_seq, winner
+
+
+def play_games_lockstep(num_games, white_network, black_network, num_simulations=AI_BUDGET):
+    """Play num_games self-play games at once in this process, searching all their positions with lockstep_MCTS
+
+    The leaves of the searches of all the games still running go through the networks together, so the batch size of
+    the networks is the number of games.
+
+    Args:
+        num_games (int): number of games
+        white_network, black_network: the networks, or anything with their call signature
+        num_simulations (int): simulations of every search
+
+    Returns:
+        The list of the (transitions, winner) pairs of the games
+    """
+    games = []
+    for _ in range(num_games):
+        ai_white = AI(AI_BUDGET, WHITE_PLAYER, transpositions=True, reuse_tree=True)
+        ai_black = AI(AI_BUDGET, BLACK_PLAYER, transpositions=True, reuse_tree=True)
+        ai_white.alphazero, ai_white.opponent = white_network, black_network
+        ai_black.alphazero, ai_black.opponent = black_network, white_network
+        games.append({'board': BitBoard(), 'ais': (ai_white, ai_black), 'states': [], 'pis': [], 'to_plays': []})
+
+    running = list(games)
+    while running:
+        searches = [(game['ais'][game['board'].turn], game['board']) for game in running]
+        results = lockstep_MCTS(searches, num_simulations)
+
+        for game, (action, pred_win_rate, root_pi) in zip(running, results):
+            board = game['board']
+            game['states'].append(board.to_planes())
+            game['pis'].append(root_pi.astype(np.float32))
+            game['to_plays'].append(board.turn)
+            board.take_action(action)
+            game['end'], game['winner'] = board.check_end_game()
+        running = [game for game in running if not game['end']]
+
+    results = []
+    for game in games:
+        values = np.array([1 if play_id == game['winner'] else -1 for play_id in game['to_plays']], dtype=np.float32)
+        game_seq = [Transition(state=x, pi_prob=pi, value=v) for x, pi, v in zip(game['states'], game['pis'], values)]
+        results.append((game_seq, game['winner']))
+    return results
+
+
+class RemoteNetwork(SearchNetwork):
+    """Network of a self-play worker: every call sends the positions to the inference server and waits for its answer"""
+
+    def __init__(self, name, worker_id, requests, responses):
+        self.name = name            # 'white' or 'black'
+        self.worker_id = worker_id
+        self.requests = requests    # queue shared by all the workers
+        self.responses = responses  # queue of this worker only
+
+    def __call__(self, x):
+        self.requests.put((self.worker_id, self.name, x.numpy()))
+        pi, v = self.responses.get()
+        return torch.from_numpy(pi), torch.from_numpy(v)
+
+
+def inference_server(checkpoints, requests, responses, max_batch=256, max_wait=0.005, device='cpu'):
+    """Main loop of the inference server process, until it receives None
+
+    The server waits for a first request, then keeps gathering requests until it has one from every worker, max_batch
+    positions or max_wait seconds passed. The positions are then evaluated with one forward pass per network.
+
+    Args:
+        checkpoints (dict): path of the checkpoint of each network in NETWORKS
+        requests (multiprocessing.Queue): the (worker id, network name, planes) requests of all the workers
+        responses (list): the response queue of every worker
+        max_batch (int): positions after which a batch is evaluated without waiting for more requests
+        max_wait (float): seconds to wait for more requests after the first one of a batch
+        device (str): device of the networks
+    """
+    torch.set_grad_enabled(False)
+    networks = {name: AlphaZeroNet.load_from_checkpoint(checkpoints[name], map_location=device).eval()
+                for name in NETWORKS}
+    num_batches = 0
+    num_positions = 0
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        pending = [request]
+        size = len(request[2])
+        deadline = time.perf_counter() + max_wait
+        while len(pending) < len(responses) and size < max_batch:
+            try:
+                request = requests.get(timeout=max(0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if request is None:
+                requests.put(None)  # answer the pending requests first, then stop
+                break
+            pending.append(request)
+            size += len(request[2])
+
+        for name, network in networks.items():
+            batch = [r for r in pending if r[1] == name]
+            if len(batch) == 0:
+                continue
+            pi, v = network(torch.from_numpy(np.concatenate([r[2] for r in batch])).to(device))
+            pi, v = pi.float().cpu().numpy(), v.float().cpu().numpy()
+
+            start = 0
+            for worker_id, _, planes in batch:
+                end = start + len(planes)
+                responses[worker_id].put((pi[start:end], v[start:end]))
+                start = end
+        num_batches += 1
+        num_positions += size
+
+    if num_batches > 0:
+        print(f"Inference server: {num_positions} positions in {num_batches} batches, "
+              f"{num_positions / num_batches:.1f} per batch")
+
+
+def selfplay_worker(worker_id, num_games, requests, response, results, timeout=60):
+    """Main loop of a self-play worker process: play num_games games and put them in results, then None"""
+    torch.set_num_threads(1)    # the networks run in the server, the worker only walks its trees
+    np.random.seed()            # forked workers inherit the same random state
+
+    white = RemoteNetwork('white', worker_id, requests, response)
+    black = RemoteNetwork('black', worker_id, requests, response)
+
+    eval_cache = EvaluationCache(EVAL_CACHE_MB // 4)
+    ai_white = AI(AI_BUDGET, WHITE_PLAYER, transpositions=True,
+                  batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, reuse_tree=True, eval_cache=eval_cache)
+    ai_black = AI(AI_BUDGET, BLACK_PLAYER, transpositions=True,
+                  batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, reuse_tree=True, eval_cache=eval_cache)
+    ai_white.alphazero, ai_white.opponent = white, black
+    ai_black.alphazero, ai_black.opponent = black, white
+
+    for _ in range(num_games):
+        results.put(play_game(ai_white, ai_black, timeout))
+    results.put(None)
+
+
+def parallel_self_play(num_games, num_workers, checkpoints, timeout=60, max_batch=256, device='cpu'):
+    """Play num_games self-play games with num_workers worker processes and one inference server
+
+    Args:
+        num_games (int): total number of games, split among the workers
+        num_workers (int): number of worker processes
+        checkpoints (dict): path of the checkpoint of the 'white' and 'black' networks
+        timeout (float): seconds of search for every move
+        max_batch (int): largest batch of positions of the server
+        device (str): device of the networks in the server
+
+    Returns:
+        The list of the (transitions, winner) pairs of the games, in the order they finished
+    """
+    num_workers = min(num_workers, num_games)
+    requests = mp.Queue()
+    responses = [mp.Queue() for _ in range(num_workers)]
+    results = mp.Queue()
+
+    server = mp.Process(target=inference_server, args=(checkpoints, requests, responses, max_batch),
+                        kwargs={'device': device}, daemon=True)
+    server.start()
+
+    workers = []
+    for worker_id in range(num_workers):
+        worker_games = num_games // num_workers + (worker_id < num_games % num_workers)
+        worker = mp.Process(target=selfplay_worker,
+                            args=(worker_id, worker_games, requests, responses[worker_id], results, timeout),
+                            daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    games = []
+    running = num_workers
+    while running > 0:
+        game = results.get()
+        if game is None:
+            running -= 1
+        else:
+            games.append(game)
+            print(f"Self-play: {len(games)}/{num_games} games")
+
+    for worker in workers:
+        worker.join()
+    requests.put(None)
+    server.join()
+    return games
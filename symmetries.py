@@ -0,0 +1,96 @@
+import numpy as np
+import torch
+
+from conversions import index_to_action, action_to_index
+from utils import *
+
+# The board (castle, camps and escapes included) is unchanged by the 8 symmetries of the square: 4 rotations, each
+# optionally followed by a transposition. Symmetry s rotates the board s % 4 times by 90 degrees, and transposes it
+# if s >= 4. The tables below give, for every symmetry, where each square and each action end up.
+
+NUM_SYMMETRIES = 8
+NUM_SQUARES = GRID_COUNT * GRID_COUNT
+CENTER = GRID_COUNT // 2
+
+def transform_offset(d, s):
+    """Apply symmetry s to a (dx, dy) displacement, i.e. to a position relative to the center"""
+    dx, dy = d
+    for _ in range(s % 4):
+        dx, dy = -dy, dx
+    if s >= 4:
+        dx, dy = dy, dx
+    return dx, dy
+
+def transform_pos(pos, s):
+    """Apply symmetry s to a board position"""
+    dx, dy = transform_offset((pos[0] - CENTER, pos[1] - CENTER), s)
+    return dx + CENTER, dy + CENTER
+
+def _square_permutations():
+    # squares in the [y, x] order of the planes, i.e. y * 9 + x
+    permutations = np.zeros((NUM_SYMMETRIES, NUM_SQUARES), dtype=np.int64)
+    for s in range(NUM_SYMMETRIES):
+        for y in range(GRID_COUNT):
+            for x in range(GRID_COUNT):
+                tx, ty = transform_pos((x, y), s)
+                permutations[s, y * GRID_COUNT + x] = ty * GRID_COUNT + tx
+    return permutations
+
+def _action_permutations():
+    # every action, including those leaving the board, is moved as a start square and a displacement
+    permutations = np.zeros((NUM_SYMMETRIES, NUM_ACTIONS), dtype=np.int64)
+    for s in range(NUM_SYMMETRIES):
+        for a in range(NUM_ACTIONS):
+            pos_start, pos_end = index_to_action(a)
+            d = transform_offset((pos_end[0] - pos_start[0], pos_end[1] - pos_start[1]), s)
+            start = transform_pos(pos_start, s)
+            permutations[s, a] = action_to_index(start, (start[0] + d[0], start[1] + d[1]))
+    return permutations
+
+# SQUARE_PERMUTATIONS[s, q] is the square q is sent to by symmetry s, ACTION_PERMUTATIONS[s, a] the same for actions
+SQUARE_PERMUTATIONS = _square_permutations()
+ACTION_PERMUTATIONS = _action_permutations()
+
+# INVERSE_SQUARE_PERMUTATIONS[s, q] is the square sent to q by symmetry s
+INVERSE_SQUARE_PERMUTATIONS = np.argsort(SQUARE_PERMUTATIONS, axis=1)
+INVERSE_ACTION_PERMUTATIONS = np.argsort(ACTION_PERMUTATIONS, axis=1)
+
+
+def transform_planes(planes, s):
+    """Apply symmetry s to (C, 9, 9) planes indexed by [y, x]"""
+    flat = planes.reshape(planes.shape[0], NUM_SQUARES)
+    return flat[:, INVERSE_SQUARE_PERMUTATIONS[s]].reshape(planes.shape)
+
+def transform_policy(pi, s):
+    """Apply symmetry s to a distribution (or mask) over the NUM_ACTIONS actions"""
+    return pi[INVERSE_ACTION_PERMUTATIONS[s]]
+
+def untransform_policy(pi, s):
+    """Undo symmetry s on a distribution over the NUM_ACTIONS actions, the inverse of transform_policy"""
+    return pi[ACTION_PERMUTATIONS[s]]
+
+def transform_planes_batch(planes, symmetries):
+    """Apply symmetry symmetries[i] to the (C, 9, 9) planes planes[i] of a (B, C, 9, 9) batch"""
+    flat = planes.reshape(len(planes), planes.shape[1], NUM_SQUARES)
+    transformed = np.take_along_axis(flat, INVERSE_SQUARE_PERMUTATIONS[symmetries][:, np.newaxis, :], axis=2)
+    return transformed.reshape(planes.shape)
+
+def random_symmetries(n):
+    """n random symmetries, drawn with torch so that every DataLoader worker gets its own"""
+    return torch.randint(NUM_SYMMETRIES, (n,)).numpy()
+
+def canonical_form(planes):
+    """Find the canonical orientation of a position, the one whose packed planes are the smallest bytes
+
+    Args:
+        planes (np.ndarray): (3, 9, 9) planes indexed by [y, x]
+
+    Returns:
+        The bytes of the canonical planes and the symmetry that sends planes to them
+    """
+    flat = planes.reshape(planes.shape[0], NUM_SQUARES) != 0
+    images = flat[:, INVERSE_SQUARE_PERMUTATIONS].transpose(1, 0, 2)     # (8, C, 81)
+    packed = np.packbits(images.reshape(NUM_SYMMETRIES, -1), axis=1)
+    keys = [row.tobytes() for row in packed]
+    s = min(range(NUM_SYMMETRIES), key=keys.__getitem__)
+    return keys[s], s
@@ -0,0 +1,60 @@
+from utils import *
+
+# Static topology of the 9x9 board, computed once at import.
+# Every table is indexed by square position (x, y) and the rays follow the order used by move generation:
+# north, east, south, west.
+
+RAY_DIRS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+
+CAMPS_SET = frozenset(CAMPS)
+ESCAPES_SET = frozenset(ESCAPES)
+ADJ_CASTLE_SET = frozenset(ADJ_CASTLE)
+
+POSITIONS = [(x, y) for y in range(GRID_COUNT) for x in range(GRID_COUNT)]
+
+def _inside(x, y):
+    return 0 <= x < GRID_COUNT and 0 <= y < GRID_COUNT
+
+def _ray(pos, d, blockers=frozenset()):
+    """Squares from pos (excluded) to the edge of the board along d, stopping before the first square in blockers"""
+    ray = []
+    x, y = pos[0] + d[0], pos[1] + d[1]
+    while _inside(x, y) and (x, y) not in blockers:
+        ray.append((x, y))
+        x, y = x + d[0], y + d[1]
+    return tuple(ray)
+
+# Full rays, regardless of what can block them
+RAYS = {pos: tuple(_ray(pos, d) for d in RAY_DIRS) for pos in POSITIONS}
+
+# The four camps, one per side of the board (west, east, north, south), four squares each
+CAMP_GROUPS = tuple(frozenset(pos for pos in CAMPS if side(pos)) for side in (
+    lambda pos: pos[0] <= 1, lambda pos: pos[0] >= GRID_COUNT - 2,
+    lambda pos: pos[1] <= 1, lambda pos: pos[1] >= GRID_COUNT - 2))
+CAMP_GROUP = {pos: g for g, group in enumerate(CAMP_GROUPS) for pos in group}
+
+# Rays cut at the first square a piece can never enter: the castle always blocks, camps block white pieces and
+# black pieces that are not standing in a camp. Black pieces inside a camp can walk inside their own camp, but not
+# into another one, so they use CAMP_MOVE_RAYS instead.
+MOVE_RAYS = {pos: tuple(_ray(pos, d, CAMPS_SET | {CASTLE}) for d in RAY_DIRS) for pos in POSITIONS}
+CAMP_MOVE_RAYS = {pos: tuple(_ray(pos, d, (CAMPS_SET - CAMP_GROUPS[CAMP_GROUP[pos]]) | {CASTLE}) for d in RAY_DIRS)
+                  for pos in CAMPS}
+
+def move_rays(pos, color):
+    """Return the four rays a piece of the given color standing on pos can slide along"""
+    if color == BLACK and pos in CAMPS_SET:
+        return CAMP_MOVE_RAYS[pos]
+    return MOVE_RAYS[pos]
+
+# For each square, the (middle, other side) pairs of every sandwich a piece landing there can close
+CAPTURE_PAIRS = {
+    pos: tuple(((pos[0] + d[0], pos[1] + d[1]), (pos[0] + 2*d[0], pos[1] + 2*d[1]))
+               for d in DIRS if _inside(pos[0] + 2*d[0], pos[1] + 2*d[1]))
+    for pos in POSITIONS
+}
+
+# Squares that must hold black pieces to capture a king standing next to the castle (the castle is the fourth side)
+KING_SURROUND = {
+    pos: tuple((pos[0] + d[0], pos[1] + d[1]) for d in DIRS if (pos[0] + d[0], pos[1] + d[1]) != CASTLE)
+    for pos in ADJ_CASTLE
+}
@@ -1,48 +1,41 @@
 import pygame
 from pathlib import Path
-from torch.utils.data import Dataset, DataLoader
-from typing import NamedTuple
-import numpy as np
+from torch.utils.data import DataLoader
 import pytorch_lightning as pl
 import time
 
 
 from Board import Board
+from BitBoard import BitBoard
 from utils import *
 from AI import *
+from EvaluationCache import EvaluationCache
+from replay_buffer import ReplayBuffer, ReplayDataset, ReplaySampler
+from selfplay import play_game, play_games_lockstep, parallel_self_play
 
 
-class Transition(NamedTuple):   
-    state: np.ndarray
-    pi_prob: np.ndarray
-    value: float
-
-class TransitionsDataset(Dataset):
-    def __init__(self, transitions) -> None:
-        super().__init__()
-        self.transitions = transitions
-
-    def __len__(self):
-        return len(self.transitions)
-    
-    def __getitem__(self, idx):
-        return self.transitions[idx]
-
 def draw(display, board):
     display.fill('white')
-    board.draw(display)
+    # the headless BitBoard cannot draw itself, so render the same position through a Board
+    Board(WINDOW_SIZE[0], WINDOW_SIZE[1], board.to_configuration()).draw(display)
     pygame.display.update()
     pygame.event.get()
 
 if __name__ == '__main__':
     num_games = 10
+    num_workers = 1     # with more than 1, self-play processes play num_workers games at a time
+    lockstep_games = 1  # with more than 1, this process plays lockstep_games games at a time, batching their leaves
     visualize = True
     if visualize:
         pygame.init()
         screen = pygame.display.set_mode(WINDOW_SIZE)
 
-    ai_white = AI(AI_BUDGET, WHITE_PLAYER)
-    ai_black = AI(AI_BUDGET, BLACK_PLAYER)
+    # one cache for both players: the white network is also black's opponent and vice versa
+    eval_cache = EvaluationCache(EVAL_CACHE_MB)
+    ai_white = AI(AI_BUDGET, WHITE_PLAYER, transpositions=True,
+                  batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, reuse_tree=True, eval_cache=eval_cache)
+    ai_black = AI(AI_BUDGET, BLACK_PLAYER, transpositions=True,
+                  batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, reuse_tree=True, eval_cache=eval_cache)
 
     WHITE_AI_PATH = Path('./ckpts/white_model.ckpt')
     BLACK_AI_PATH = Path('./ckpts/black_model.ckpt')
@@ -61,82 +54,51 @@ if __name__ == '__main__':
     ai_white.alphazero.eval()
     ai_black.alphazero.eval()
 
-    for j in range(num_games):
-        print(f"-------------Game {j}-------------")
-        board = Board(WINDOW_SIZE[0], WINDOW_SIZE[1])
-
-        game_states = []
-        game_pis = []
-        game_values = []
-        to_plays = []
-
-        running = True
-
-        if visualize:
-            draw(screen, board)
-        z = 0
-        while running:
-            # start = time.process_time()
-            if board.turn == WHITE_PLAYER:
-                action, pred_win_rate, root_pi = ai_white.MCTS(board)
-                # print("White's turn played with pred win rate", pred_win_rate)
-                z += 1
-
-            else:
-                action, pred_win_rate, root_pi = ai_black.MCTS(board)
-                # print("Black's turn played with pred win rate", pred_win_rate)
-
-            
-            # print(f"Time taken for action: {time.process_time() - start}")
-
-            game_states.append(board.to_onehot_tensor().squeeze())
-            game_pis.append(torch.from_numpy(root_pi).float())
-            game_values.append(0)
-            to_plays.append(board.turn)
-
-            board.take_action(action)
-
-            # else:
-            #     mx, my = pygame.mouse.get_pos()
-            #     for event in pygame.event.get():
-			# 		# Quit the game if the user presses the close button
-            #         if event.type == pygame.QUIT:
-            #             running = False
-            #         elif event.type == pygame.MOUSEBUTTONDOWN: 
-			# 			# If the mouse is clicked
-            #             if event.button == 1:
-            #                 board.handle_click(mx, my)
-
+    # the positions of all the games, on disk, one buffer per network
+    white_buffer = ReplayBuffer('./replay/white')
+    black_buffer = ReplayBuffer('./replay/black')
+    print(f"Replay buffers: {len(white_buffer)} white and {len(black_buffer)} black positions")
+
+    j = 0
+    while j < num_games:
+        if num_workers > 1:
+            # one round of games in parallel, all played with the current weights, then one training on all of them
+            print(f"-------------Games {j}-{min(j + num_workers, num_games) - 1}-------------")
+            games = parallel_self_play(min(num_workers, num_games - j), num_workers,
+                                       {'white': WHITE_AI_PATH, 'black': BLACK_AI_PATH})
+        elif lockstep_games > 1:
+            print(f"-------------Games {j}-{min(j + lockstep_games, num_games) - 1}-------------")
+            games = play_games_lockstep(min(lockstep_games, num_games - j), ai_white.alphazero, ai_black.alphazero)
+        else:
+            print(f"-------------Game {j}-------------")
+            on_move = (lambda board: draw(screen, board)) if visualize else None
             if visualize:
-                draw(screen, board) # Uncomment if want to see the game playing on
-
-            end, winner = board.check_end_game()
-            if end:
-                running = False
+                draw(screen, BitBoard())
+            games = [play_game(ai_white, ai_black, on_move=on_move)]
+            print(f"Transposition hit rate: white {ai_white.tt_hit_rate():.1%}, black {ai_black.tt_hit_rate():.1%}")
+            print(f"Evaluation cache: {eval_cache.stats()}")
 
-                for i, play_id in enumerate(to_plays):
-                    if play_id == winner:
-                        game_values[i] = 1
-                    else:
-                        game_values[i] = -1
-                game_values = np.array(game_values, dtype=np.float32)
-            
+        for game_seq, winner in games:
+            print(f"Game {j} lasted {len(game_seq)} moves and {'White' if winner==WHITE_PLAYER else 'Black'} won!")
+            j += 1
 
-        game_seq = [
-            Transition(state=x, pi_prob=pi, value=v) for x, pi, v in zip(game_states, game_pis, game_values)
-        ]
+        white_transitions_data = [t for game_seq, _ in games for t in game_seq[0::2]]
+        black_transitions_data = [t for game_seq, _ in games for t in game_seq[1::2]]
 
-        print(f"Game {j} lasted {len(game_seq)} moves and {'White' if winner==WHITE_PLAYER else 'Black'} won!")
-        
-        white_transitions_data = game_seq[0::2]
-        black_transitions_data = game_seq[1::2]
 
+        white_buffer.add(white_transitions_data)
+        black_buffer.add(black_transitions_data)
 
-        dataset_white = TransitionsDataset(white_transitions_data)
-        dataset_black = TransitionsDataset(black_transitions_data)
+        # every epoch draws as many positions as the new games brought, from the whole window, favouring recent ones
+        dataset_white = ReplayDataset(white_buffer)
+        dataset_black = ReplayDataset(black_buffer)
+        sampler_white = ReplaySampler(dataset_white, len(white_transitions_data), half_life=REPLAY_WINDOW // 4)
+        sampler_black = ReplaySampler(dataset_black, len(black_transitions_data), half_life=REPLAY_WINDOW // 4)
 
-        train_dataloader_white = DataLoader(dataset_white, batch_size=len(white_transitions_data)//4, shuffle=True)
-        train_dataloader_black = DataLoader(dataset_black, batch_size=len(black_transitions_data)//4, shuffle=True)
+        train_dataloader_white = DataLoader(dataset_white, batch_size=len(white_transitions_data)//4, sampler=sampler_white,
+                                            collate_fn=dataset_white.collate)
+        train_dataloader_black = DataLoader(dataset_black, batch_size=len(black_transitions_data)//4, sampler=sampler_black,
+                                            collate_fn=dataset_black.collate)
 
         ai_white.alphazero.train()
         ai_black.alphazero.train()
@@ -149,5 +111,10 @@ if __name__ == '__main__':
         print("Training BLACK...")
         trainer_black.fit(ai_black.alphazero, train_dataloader_black)
         trainer_black.save_checkpoint(BLACK_AI_PATH) 
+
+        # the cached evaluations belong to the old weights
+        eval_cache.clear()
+        ai_white.alphazero.eval()
+        ai_black.alphazero.eval()
     
     print(f"Terminated after {num_games} games")
\ No newline at end of file
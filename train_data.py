@@ -1,64 +1,39 @@
-from torch.utils.data import Dataset, DataLoader
-import os
+from torch.utils.data import DataLoader
 from pathlib import Path
 import pytorch_lightning as pl
 from pytorch_lightning.loggers import WandbLogger
 
 
 from AlphaZeroNet import AlphaZeroNet
+from ColumnarDataset import ColumnarDataset
+from corpus import update_corpus, load_corpus
 from data_handler import *
 from utils import *
 
-class TransitionsDataset(Dataset):
-    def __init__(self, transitions) -> None:
-        super().__init__()
-        self.transitions = transitions
-
-    def __len__(self):
-        return len(self.transitions)
-    
-    def __getitem__(self, idx):
-        return self.transitions[idx]
-    
 
 if __name__ == '__main__':
     NUM_EPOCHS = 100
 
-    # Create the two sets of transitions from data and pass it to the dataset
-    white_transitions = []
-    black_transitions = []
-
-    draws = 0
-    invalids = 0
-    for filename in os.listdir('data'):
-        
-        try:
-            game_sequence = file_to_game_sequence(f"data/{filename}")
-        except Exception as e:
-            invalids += 1
-            continue
-
-        if game_sequence == []:
-            draws += 1
-            continue
-
-        white_transitions.extend(game_sequence[::2])
-        black_transitions.extend(game_sequence[1::2])
-
-    print(f"White transitions collected {len(white_transitions)}")
-    print(f"Black transitions collected {len(black_transitions)}")
-    print("Draws:", draws)
-    print("Invalids:", invalids)
+    # Parse the new logs in data into the binary corpus, then create the two datasets from its columns
+    corpus_stats = update_corpus('data')
+    print(f"Corpus: {corpus_stats['parsed']} logs parsed, {corpus_stats['reused']} unchanged")
+    corpus = load_corpus()
+    white_dataset = ColumnarDataset.from_corpus(corpus, WHITE_PLAYER)
+    black_dataset = ColumnarDataset.from_corpus(corpus, BLACK_PLAYER)
 
-    white_dataset = TransitionsDataset(white_transitions)
-    black_dataset = TransitionsDataset(black_transitions)
+    print(f"White transitions collected {len(white_dataset)} ({white_dataset.nbytes() / 2**20:.1f} MB)")
+    print(f"Black transitions collected {len(black_dataset)} ({black_dataset.nbytes() / 2**20:.1f} MB)")
+    print("Draws:", corpus_stats['draws'])
+    print("Invalids:", corpus_stats['invalids'])
 
     # train_white_dataset, val_white_dataset = torch.utils.data.random_split(white_dataset, [0.8, 0.2])
     # train_black_dataset, val_black_dataset = torch.utils.data.random_split(black_dataset, [0.8, 0.2])
 
     # Create the dataloaders
-    train_white_dataloader = DataLoader(white_dataset, batch_size=64, shuffle=True, num_workers=4, persistent_workers=True)
-    train_black_dataloader = DataLoader(black_dataset, batch_size=64, shuffle=True, num_workers=4, persistent_workers=True)
+    train_white_dataloader = DataLoader(white_dataset, batch_size=64, shuffle=True, num_workers=4, persistent_workers=True,
+                                        collate_fn=white_dataset.collate)
+    train_black_dataloader = DataLoader(black_dataset, batch_size=64, shuffle=True, num_workers=4, persistent_workers=True,
+                                        collate_fn=black_dataset.collate)
 
     # val_white_dataloader = DataLoader(val_white_dataset, batch_size=64, shuffle=False, num_workers=4, persistent_workers=True)
     # val_black_dataloader = DataLoader(val_black_dataset, batch_size=64, shuffle=False, num_workers=4, persistent_workers=True)
@@ -2,10 +2,16 @@ import socket
 import struct
 import sys
 import json
+import random
+import multiprocessing
+import numpy as np
+import torch
 
-from Board import Board
+from BitBoard import BitBoard
 from AlphaZeroNet import AlphaZeroNet
 from AI import AI
+from EvaluationCache import EvaluationCache
+from inference import export_for_inference
 from utils import *
 from pathlib import Path
 
@@ -19,6 +25,59 @@ def recvall(sock, n):
         data += packet
     return data
 
+def load_ai(color):
+    """Create the AI playing color, with the networks loaded from the checkpoints and exported for inference"""
+    ai = AI(AI_BUDGET, WHITE_PLAYER if color == 'white' else BLACK_PLAYER, transpositions=True,
+            batch_size=MCTS_BATCH_SIZE, virtual_loss=VIRTUAL_LOSS, reuse_tree=True,
+            eval_cache=EvaluationCache(EVAL_CACHE_MB))
+    WHITE_AI_PATH = Path('./ckpts/white_model.ckpt')
+    BLACK_AI_PATH = Path('./ckpts/black_model.ckpt')
+
+    white_alphazero = None
+    black_alphazero = None
+    if WHITE_AI_PATH.is_file():
+        white_alphazero = AlphaZeroNet.load_from_checkpoint(WHITE_AI_PATH)
+    if BLACK_AI_PATH.is_file():
+        black_alphazero = AlphaZeroNet.load_from_checkpoint(BLACK_AI_PATH)
+
+    if white_alphazero is not None and black_alphazero is not None:
+        white_alphazero = export_for_inference(white_alphazero)
+        black_alphazero = export_for_inference(black_alphazero)
+        ai.alphazero = white_alphazero if color == 'white' else black_alphazero
+        ai.opponent = black_alphazero if color == 'white' else white_alphazero
+    else:
+        raise Exception("Models not found")
+    return ai
+
+# Root parallel search: every process of the pool runs its own search from the same root, with its own Dirichlet
+# noise, and the move is chosen from the sum of their root visit counts
+worker_ai = None
+
+def init_search_worker(color):
+    """Pool initializer, loads the networks once for the whole game"""
+    global worker_ai
+    torch.set_num_threads(1)    # the cores are already shared among the processes
+    worker_ai = load_ai(color)
+
+def search_worker(state, timeout, seed):
+    np.random.seed(seed)
+    random.seed(seed)
+    board = BitBoard(state['board'], turn=state['turn'])
+    worker_ai.MCTS(board, timeout=timeout)
+    return worker_ai.root.to_dense(worker_ai.root.child_N), worker_ai.simulations
+
+def root_parallel_search(pool, num_processes, state, timeout):
+    """Search the server state with num_processes independent searches and merge their root visit counts
+
+    Returns:
+        The chosen move and the total number of simulations
+    """
+    seeds = [random.randrange(2**32) for _ in range(num_processes)]
+    results = pool.starmap(search_worker, [(state, timeout, seed) for seed in seeds], chunksize=1)
+    visits = sum(child_N for child_N, _ in results)
+    board = BitBoard(state['board'], turn=state['turn'])
+    return board.index_to_action(np.argmax(visits)), sum(simulations for _, simulations in results)
+
 def move_to_json(move, color):
     from_pos = move[0]
     to_pos = move[1]
@@ -38,24 +97,15 @@ if __name__ == "__main__":
     color = sys.argv[1].lower() if len(sys.argv) >= 2 else 'white'
     timeout = int(sys.argv[2]) if len(sys.argv) >= 3 else 60
     server_ip = sys.argv[3] if len(sys.argv) >= 4 else 'localhost'
+    num_processes = int(sys.argv[4]) if len(sys.argv) >= 5 else 1
+    # ponder while the opponent thinks, the single process search only
+    ponder = num_processes == 1 and (sys.argv[5].lower() != 'noponder' if len(sys.argv) >= 6 else True)
 
-    # define AI and load models
-    ai = AI(AI_BUDGET, WHITE_PLAYER if color == 'white' else BLACK_PLAYER)
-    WHITE_AI_PATH = Path('./ckpts/white_model.ckpt')
-    BLACK_AI_PATH = Path('./ckpts/black_model.ckpt')
-
-    white_alphazero = None
-    black_alphazero = None
-    if WHITE_AI_PATH.is_file():
-        white_alphazero = AlphaZeroNet.load_from_checkpoint(WHITE_AI_PATH)
-    if BLACK_AI_PATH.is_file():
-        black_alphazero = AlphaZeroNet.load_from_checkpoint(BLACK_AI_PATH)
-
-    if white_alphazero is not None and black_alphazero is not None:
-        ai.alphazero = white_alphazero if color == 'white' else black_alphazero
-        ai.opponent = black_alphazero if color == 'white' else white_alphazero
+    # define AI and load models, once per process when searching in parallel
+    if num_processes > 1:
+        pool = multiprocessing.Pool(num_processes, initializer=init_search_worker, initargs=(color,))
     else:
-        raise Exception("Models not found")
+        ai = load_ai(color)
     
 
     # define server port depending on color
@@ -77,17 +127,28 @@ if __name__ == "__main__":
         if color == 'black':
             len_bytes = struct.unpack('>i', recvall(sock, 4))[0]
             current_state_server_bytes = sock.recv(len_bytes).decode('utf-8')
+            if ponder:
+                json_current_state_server = json.loads(current_state_server_bytes)
+                ai.start_pondering(BitBoard(json_current_state_server['board'], turn=json_current_state_server['turn']))
 
         while True:
             len_bytes = struct.unpack('>i', recvall(sock, 4))[0]
             current_state_server_bytes = sock.recv(len_bytes).decode('utf-8')
 
             json_current_state_server = json.loads(current_state_server_bytes)
-                    
-            board = Board(WINDOW_SIZE[0], WINDOW_SIZE[1], json_current_state_server['board'], turn=json_current_state_server['turn'])
 
+            if ponder:
+                print(f"Simulations while pondering: {ai.stop_pondering()}")
+                    
             # MCTS search
-            move, _, _ = ai.MCTS(board, timeout=timeout)
+            if num_processes > 1:
+                move, simulations = root_parallel_search(pool, num_processes, json_current_state_server, timeout)
+                print(f"Simulations of the {num_processes} searches: {simulations}")
+            else:
+                board = BitBoard(json_current_state_server['board'], turn=json_current_state_server['turn'])
+                move, _, _ = ai.MCTS(board, timeout=timeout)
+                print(f"Transposition hit rate so far: {ai.tt_hit_rate():.1%}, visits reused: {ai.reused_visits:.0f}")
+                print(f"Evaluation cache: {ai.eval_cache.stats()}")
 
             # Convert from coordinates move to literals move
             move_for_server = json.dumps(move_to_json(move, color))
@@ -95,6 +156,11 @@ if __name__ == "__main__":
             sock.send(struct.pack('>i', len(move_for_server)))
             sock.send(move_for_server.encode())
 
+            # keep searching the position after our move while we wait for the opponent's reply
+            if ponder:
+                board.take_action(move)
+                ai.start_pondering(board)
+
             # read response from server with the modified board by this move
             len_bytes = struct.unpack('>i', recvall(sock, 4))[0]
             current_state_server_bytes = sock.recv(len_bytes).decode('utf-8')
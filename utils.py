@@ -40,4 +40,10 @@ WIDTH = 0
 DIRS = [[-1, 0], [0, -1], [0, 1], [1, 0]]
 
 AI_BUDGET = 500    # 1600 is how many simulation AlphaZero uses
+MCTS_BATCH_SIZE = 8     # leaves evaluated together in one forward pass
+VIRTUAL_LOSS = 1
+EVAL_CACHE_MB = 512     # memory cap of the network evaluation cache
+REPLAY_WINDOW = 500000  # self-play positions kept by the replay buffer of each colour
+REPLAY_SHARD_SIZE = 4096
+REPLAY_POLICY_ENTRIES = 128     # most visited actions kept of every search policy, as (index, probability) pairs
 NUM_ACTIONS = 9 * 9 * 32
\ No newline at end of file
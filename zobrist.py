@@ -0,0 +1,21 @@
+import random
+
+from utils import *
+
+# Fixed seed: hashes must agree between runs and between processes
+_rng = random.Random(20231122)
+
+BLACK_KIND = 0
+WHITE_KIND = 1
+KING_KIND = 2
+
+# PIECE_KEYS[kind][y * 9 + x], kinds follow the order of the one-hot planes (black, white, king)
+PIECE_KEYS = [[_rng.getrandbits(64) for _ in range(GRID_COUNT * GRID_COUNT)] for _ in range(3)]
+BLACK_TO_MOVE_KEY = _rng.getrandbits(64)
+
+
+def piece_key(kind, pos):
+    return PIECE_KEYS[kind][pos[1] * GRID_COUNT + pos[0]]
+
+def turn_key(turn):
+    return BLACK_TO_MOVE_KEY if turn == BLACK_PLAYER else 0